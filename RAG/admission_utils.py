@@ -0,0 +1,216 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Callable, Dict, Hashable, List
+
+from RAG.metrics_utils import Counter, metrics, recordStage
+
+# Concurrent generations per model; further requests wait in a bounded queue
+MODEL_MAX_CONCURRENCY = int(os.getenv('MODEL_MAX_CONCURRENCY', 8))
+MODEL_MAX_QUEUE = int(os.getenv('MODEL_MAX_QUEUE', 32))
+# Seconds a queued request waits for a free slot before it is turned away
+MODEL_QUEUE_TIMEOUT = float(os.getenv('MODEL_QUEUE_TIMEOUT', 30))
+
+admissionRejected = Counter('chatdocs_admission_rejected_total', 'Chat requests turned away by admission control',
+                            ('model', 'reason'))
+chatCoalesced = Counter('chatdocs_chat_coalesced_total', 'Chat requests served by an identical in-flight generation',
+                        ('model',))
+metrics.extend([admissionRejected, chatCoalesced])
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request can't be admitted; `statusCode` is 429 if the
+    queue is full and 503 if the request timed out waiting in it
+    """
+
+    def __init__(self, statusCode: int, detail: str, retryAfter: int):
+        super().__init__(detail)
+        self.statusCode = statusCode
+        self.detail = detail
+        self.retryAfter = retryAfter
+
+
+# --- Admission Control -------------------------------------------------
+
+class ModelAdmission:
+    """
+    At most `maxConcurrent` generations at a time for one model, with up
+    to `maxQueue` requests waiting for a slot. Requests beyond that are
+    rejected right away rather than piling up behind the upstream rate limit.
+    """
+
+    def __init__(self, model: str, maxConcurrent: int = MODEL_MAX_CONCURRENCY,
+                 maxQueue: int = MODEL_MAX_QUEUE, queueTimeout: float = MODEL_QUEUE_TIMEOUT):
+        self.model = model
+        self.maxConcurrent = maxConcurrent
+        self.maxQueue = maxQueue
+        self.queueTimeout = queueTimeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(maxConcurrent)
+
+    async def acquire(self):
+        if self._semaphore.locked() and self.waiting >= self.maxQueue:
+            admissionRejected.inc(model=self.model, reason='queue_full')
+            raise AdmissionRejected(429, f"Too many requests for {self.model}, try again shortly", retryAfter=1)
+
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queueTimeout)
+        except asyncio.TimeoutError:
+            admissionRejected.inc(model=self.model, reason='queue_timeout')
+            raise AdmissionRejected(503, f"{self.model} is busy, try again later", retryAfter=5)
+        finally:
+            self.waiting -= 1
+        recordStage('chat_queue_wait', time.perf_counter() - start)
+
+    def release(self):
+        self._semaphore.release()
+
+
+admissions: Dict[str, ModelAdmission] = {}
+
+def getAdmission(model: str) -> ModelAdmission:
+    admission = admissions.get(model)
+    if admission is None:
+        admission = admissions[model] = ModelAdmission(model)
+    return admission
+
+
+# --- Single-Flight Generation ------------------------------------------
+
+class Flight:
+    """
+    One generation running as its own task, streamed to every request that
+    joins it. The task first waits for a slot of the model's admission
+    control, so identical requests that arrive meanwhile join it instead of
+    queueing themselves. Late joiners get the chunks produced so far first.
+    The generation is cancelled once every request has left, e.g. because
+    all clients disconnected.
+    """
+
+    def __init__(self, admission: ModelAdmission, produce: Callable[[], AsyncIterator[str]],
+                 onDone: Callable[[], None]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error = None
+        self.rejection: AdmissionRejected | None = None
+        self.subscribers = 0
+        self._admitted = asyncio.Event()
+        self._changed = asyncio.Condition()
+        self._onDone = onDone
+        self.task = asyncio.create_task(self._run(admission, produce))
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _run(self, admission, produce):
+        acquired = False
+        try:
+            await admission.acquire()
+            acquired = True
+            self._admitted.set()
+            async for chunk in produce():
+                self.chunks.append(chunk)
+                await self._notify()
+        except AdmissionRejected as e:
+            self.rejection = e
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            if acquired:
+                admission.release()
+            self.done = True
+            self._admitted.set()
+            self._onDone()
+            await self._notify()
+
+    async def waitAdmitted(self):
+        """
+        Wait until the generation got a slot; raises its AdmissionRejected
+        if it was turned away instead
+        """
+        await self._admitted.wait()
+        if self.rejection is not None:
+            raise self.rejection
+
+    def join(self) -> 'FlightSubscription':
+        self.subscribers += 1
+        return FlightSubscription(self)
+
+    def leave(self):
+        self.subscribers -= 1
+        if not self.subscribers and not self.done:
+            # Unregister right away, so a request arriving before the task
+            # has wound down starts a new generation instead of joining this one
+            self._onDone()
+            self.task.cancel()
+
+
+class FlightSubscription:
+    """
+    One request's view of a Flight. `leave` is idempotent, so it can also
+    run as a response background task in case the stream never started.
+    """
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self.left = False
+
+    def leave(self):
+        if not self.left:
+            self.left = True
+            self.flight.leave()
+
+    async def __aiter__(self):
+        flight = self.flight
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                async with flight._changed:
+                    await flight._changed.wait_for(lambda: index < len(flight.chunks) or flight.done)
+        finally:
+            self.leave()
+
+
+class SingleFlight:
+    """
+    Runs at most one generation per key at a time; identical concurrent
+    requests join the one in flight instead of starting their own. A
+    generation goes through admission control once, however many requests
+    share it, and all of them are turned away if it is rejected.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, Flight] = {}
+
+    async def join(self, key: Hashable, model: str,
+                   produce: Callable[[], AsyncIterator[str]]) -> FlightSubscription:
+        flight = self.flights.get(key)
+        if flight is None:
+            def onDone():
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight = self.flights[key] = Flight(getAdmission(model), produce, onDone)
+        else:
+            chatCoalesced.inc(model=model)
+
+        subscription = flight.join()
+        try:
+            await flight.waitAdmitted()
+        except BaseException:
+            # Rejected, or this request was cancelled while it waited
+            subscription.leave()
+            raise
+        return subscription
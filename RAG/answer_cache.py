@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import List
+
+import numpy as np
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 5000
+
+
+# --- Semantic Answer Cache ---------------------------------------------
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of generated answers, keyed by the embedding of the
+    standalone question together with the model name and corpus version.
+
+    A lookup hits when a cached question for the same model and corpus
+    version has cosine similarity >= `threshold` with the new question.
+    Entries expire after `ttl` seconds and the least recently used are
+    evicted beyond `maxEntries`.
+
+    The normalized embeddings live in one preallocated matrix, one row per
+    entry, with the model, corpus version, expiry and last use of each row
+    in arrays beside it. A lookup is a single matrix-vector product over
+    the rows in use, masked to the rows that may hit; expired and outdated
+    rows are simply skipped, and their slots reused by later stores.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 ttl: float = DEFAULT_TTL_SECONDS, maxEntries: int = DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Model name -> small integer stored per row
+        self._modelIds = {}
+        self._answers: List[str | None] = [None] * maxEntries
+        self._valid = np.zeros(maxEntries, dtype=bool)
+        self._models = np.zeros(maxEntries, dtype=np.int32)
+        self._corpusVersions = np.zeros(maxEntries, dtype=np.int64)
+        self._expiresAt = np.zeros(maxEntries, dtype=np.float64)
+        self._lastUsed = np.zeros(maxEntries, dtype=np.int64)
+        self._clock = 0
+        # Allocated on the first store, once the embedding size is known
+        self._matrix = None
+        # Rows [0, _used) have been written at least once
+        self._used = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def lookup(self, embedding: List[float], model: str, corpusVersion: int) -> str | None:
+        """
+        Return the cached answer for a sufficiently similar question, or None
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            modelId = self._modelIds.get(model)
+            used = self._used
+            if modelId is not None and used and query.shape[0] == self._matrix.shape[1]:
+                similarities = self._matrix[:used] @ query
+                live = (self._valid[:used] & (self._models[:used] == modelId)
+                        & (self._corpusVersions[:used] == corpusVersion)
+                        & (self._expiresAt[:used] > time.monotonic()))
+                similarities[~live] = -np.inf
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._lastUsed[best] = self._tick()
+                    self.hits += 1
+                    return self._answers[best]
+
+            self.misses += 1
+            return None
+
+    def _freeRow(self, corpusVersion: int) -> int:
+        if self._used < self.maxEntries:
+            self._used += 1
+            return self._used - 1
+        # Entries from an older corpus version can never hit again
+        reusable = ~self._valid | (self._expiresAt <= time.monotonic()) | (self._corpusVersions < corpusVersion)
+        if reusable.any():
+            return int(np.argmax(reusable))
+        return int(np.argmin(self._lastUsed))
+
+    def store(self, embedding: List[float], model: str, corpusVersion: int, answer: str):
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # First entry, or the embedding backend changed: earlier rows can't be compared
+                self._matrix = np.zeros((self.maxEntries, vector.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+                self._used = 0
+            row = self._freeRow(corpusVersion)
+            self._matrix[row] = vector
+            self._models[row] = self._modelIds.setdefault(model, len(self._modelIds))
+            self._corpusVersions[row] = corpusVersion
+            self._expiresAt[row] = time.monotonic() + self.ttl
+            self._lastUsed[row] = self._tick()
+            self._answers[row] = answer
+            self._valid[row] = True
+
+    def clear(self):
+        with self._lock:
+            self._valid[:] = False
+            self._answers = [None] * self.maxEntries
+            self._used = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            live = self._valid[:self._used] & (self._expiresAt[:self._used] > time.monotonic())
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "entries": int(np.count_nonzero(live)),
+                "maxEntries": self.maxEntries,
+            }
@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Iterable, List, Tuple
+
+from langchain_core.callbacks import (AsyncCallbackManagerForRetrieverRun,
+                                      CallbackManagerForRetrieverRun)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+BM25_INDEX_PATH = 'bm25_index.db'
+
+# Identifiers such as "AB-1234", "ERR_404" or "v2.1.3" are kept whole and
+# also indexed by their parts
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[-_./:][a-z0-9]+)*')
+PART_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def hashChunkText(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def getChunkKey(document: Document) -> str:
+    """
+    Key identifying a chunk across the lexical index and Chroma
+    """
+    chunkId = document.metadata.get('chunkId')
+    if chunkId:
+        return chunkId
+    # Chunks indexed before chunk ids existed
+    return hashChunkText(document.page_content)
+
+
+# --- BM25 Inverted Index -----------------------------------------------
+
+class BM25Index:
+    """
+    BM25 inverted index stored in SQLite: postings, chunk lengths and the
+    collection statistics. Changes are written in place, so an update costs
+    time in proportion to the chunks it touches rather than to the corpus,
+    and every process (e.g. uvicorn worker) sharing the file sees it as
+    soon as it is committed. Chunk texts are not stored; `search` returns
+    chunk ids, and the texts are read from Chroma.
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        # One connection per thread; also tracks that thread's open transaction
+        self._local = threading.local()
+        self._createTables()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit: transactions are begun explicitly by `transaction`
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    def _createTables(self):
+        with self.transaction() as index:
+            conn = index._connection()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS lexical_chunks (
+                    id INTEGER PRIMARY KEY,
+                    chunkKey TEXT NOT NULL UNIQUE,
+                    fileId INTEGER,
+                    length INTEGER NOT NULL
+                    )'''
+            )
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS lexical_postings (
+                    term TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk)
+                    ) WITHOUT ROWID'''
+            )
+            # length duplicates lexical_chunks.length, so scoring reads only the postings
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS lexical_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    docCount INTEGER NOT NULL DEFAULT 0,
+                    totalLength INTEGER NOT NULL DEFAULT 0
+                    )'''
+            )
+            # Removing a chunk looks its postings up by chunk
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_lexical_postings_chunk ON lexical_postings (chunk)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_lexical_chunks_fileId ON lexical_chunks (fileId)')
+            conn.execute('INSERT OR IGNORE INTO lexical_stats (id, docCount, totalLength) VALUES (1, 0, 0)')
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group changes into one SQLite transaction, so searches see all of
+        them or none. Nested transactions join the outermost one.
+        """
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield self
+            finally:
+                self._local.depth -= 1
+            return
+
+        # IMMEDIATE takes the write lock up front, so concurrent writers queue instead of failing
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield self
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            self._local.depth = 0
+
+    @contextmanager
+    def _snapshot(self):
+        """
+        Read the statistics and postings from one consistent version
+        """
+        conn = self._connection()
+        if self._local.depth:
+            yield conn
+            return
+        # A deferred transaction only reads; under WAL it never waits for writers
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.commit()
+
+    def __len__(self):
+        return self._connection().execute('SELECT docCount FROM lexical_stats').fetchone()[0]
+
+    def keys(self) -> set:
+        return {row[0] for row in self._connection().execute('SELECT chunkKey FROM lexical_chunks')}
+
+    def add(self, documents: Iterable[Document]):
+        with self.transaction():
+            conn = self._connection()
+            added = addedLength = 0
+            for document in documents:
+                key = getChunkKey(document)
+                self._remove(conn, key)
+                termCounts = Counter(tokenize(document.page_content))
+                length = sum(termCounts.values())
+                chunk = conn.execute('INSERT INTO lexical_chunks (chunkKey, fileId, length) VALUES (?, ?, ?)',
+                                     (key, document.metadata.get('fileId'), length)).lastrowid
+                conn.executemany('INSERT INTO lexical_postings (term, chunk, tf, length) VALUES (?, ?, ?, ?)',
+                                 [(term, chunk, count, length) for term, count in termCounts.items()])
+                added += 1
+                addedLength += length
+            self._updateStats(conn, added, addedLength)
+
+    @staticmethod
+    def _updateStats(conn: sqlite3.Connection, docCount: int, totalLength: int):
+        if docCount:
+            conn.execute('UPDATE lexical_stats SET docCount = docCount + ?, totalLength = totalLength + ?',
+                         (docCount, totalLength))
+
+    def _remove(self, conn: sqlite3.Connection, key: str) -> bool:
+        row = conn.execute('SELECT id, length FROM lexical_chunks WHERE chunkKey = ?', (key,)).fetchone()
+        if row is None:
+            return False
+        chunk, length = row
+        conn.execute('DELETE FROM lexical_postings WHERE chunk = ?', (chunk,))
+        conn.execute('DELETE FROM lexical_chunks WHERE id = ?', (chunk,))
+        self._updateStats(conn, -1, -length)
+        return True
+
+    def removeKeys(self, keys: Iterable[str]):
+        with self.transaction():
+            conn = self._connection()
+            for key in keys:
+                self._remove(conn, key)
+
+    def removeFile(self, fileId: int):
+        with self.transaction():
+            conn = self._connection()
+            for (key,) in conn.execute('SELECT chunkKey FROM lexical_chunks WHERE fileId = ?', (fileId,)).fetchall():
+                self._remove(conn, key)
+
+    def clear(self):
+        with self.transaction():
+            conn = self._connection()
+            conn.execute('DELETE FROM lexical_postings')
+            conn.execute('DELETE FROM lexical_chunks')
+            conn.execute('UPDATE lexical_stats SET docCount = 0, totalLength = 0')
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        The `k` best matching chunk keys with their BM25 scores. Scoring
+        runs in SQLite, so only the top `k` rows come back to Python.
+        """
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return []
+        with self._snapshot() as conn:
+            docCount, totalLength = conn.execute('SELECT docCount, totalLength FROM lexical_stats').fetchone()
+            if not docCount:
+                return []
+            documentFrequencies = conn.execute(f'''
+                SELECT term, COUNT(*) FROM lexical_postings
+                WHERE term IN ({','.join('?' * len(terms))}) GROUP BY term''', terms).fetchall()
+            if not documentFrequencies:
+                return []
+
+            parameters = []
+            for term, frequency in documentFrequencies:
+                parameters += [term, math.log(1 + (docCount - frequency + 0.5) / (frequency + 0.5))]
+            # tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / averageLength)), with the constants folded
+            averageLength = totalLength / docCount
+            parameters += [self.k1 + 1, self.k1 * (1 - self.b), self.k1 * self.b / averageLength, k]
+            return conn.execute(f'''
+                WITH queryTerms (term, idf) AS (VALUES {','.join(['(?, ?)'] * len(documentFrequencies))})
+                SELECT c.chunkKey, scored.score FROM (
+                    SELECT p.chunk, SUM(q.idf * p.tf * ? / (p.tf + ? + ? * p.length)) AS score
+                    FROM queryTerms q JOIN lexical_postings p ON p.term = q.term
+                    GROUP BY p.chunk ORDER BY score DESC LIMIT ?
+                ) scored JOIN lexical_chunks c ON c.id = scored.chunk
+                ORDER BY scored.score DESC''', parameters).fetchall()
+
+
+# --- Hybrid Retriever --------------------------------------------------
+
+def reciprocalRankFusion(rankings: List[List[Document]], rrfK: int = 60) -> List[Document]:
+    """
+    Merge ranked lists with reciprocal rank fusion: score = sum 1 / (rrfK + rank)
+    """
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = getChunkKey(document)
+            scores[key] += 1 / (rrfK + rank)
+            documents.setdefault(key, document)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses dense Chroma results with BM25 results, so that exact identifiers
+    are found even when their embeddings are not close to the query's
+    """
+
+    vectorstore: object
+    lexicalIndex: object
+    k: int = 2
+    fetchK: int = 10
+    rrfK: int = 60
+
+    def lexicalSearch(self, query: str) -> List[Document]:
+        """
+        BM25 search; the index only holds chunk ids, so the matching
+        chunks are read from Chroma, in rank order
+        """
+        keys = [key for key, _ in self.lexicalIndex.search(query, self.fetchK)]
+        if not keys:
+            return []
+        page = self.vectorstore._collection.get(ids=keys, include=['documents', 'metadatas'])
+        documents = {chunkId: Document(page_content=text, metadata=metadata or {})
+                     for chunkId, text, metadata in zip(page['ids'], page['documents'], page['metadatas'])}
+        return [documents[key] for key in keys if key in documents]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense = self.vectorstore.similarity_search(query, k=self.fetchK)
+        sparse = self.lexicalSearch(query)
+        return reciprocalRankFusion([dense, sparse], self.rrfK)[:self.k]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # Run both searches concurrently
+        dense, sparse = await asyncio.gather(
+            self.vectorstore.asimilarity_search(query, k=self.fetchK),
+            asyncio.to_thread(self.lexicalSearch, query),
+        )
+        return reciprocalRankFusion([dense, sparse], self.rrfK)[:self.k]
@@ -1,65 +1,510 @@
-from typing import List
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
 
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import (Docx2txtLoader, PyPDFLoader,
-                                                  UnstructuredHTMLLoader)
+from filelock import FileLock
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 
-# Initialize text splitter and embedding function
-textSplitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
-embeddingFunction = OpenAIEmbeddings()
+from RAG.bm25_utils import BM25Index, hashChunkText
+from RAG.db_utils import (bumpCorpusVersion, clearChunkRecords,
+                          countChunkRecords, deleteChunkRecords,
+                          deleteChunkRecordsForFile,
+                          getAllChunkRecords, getChunkIds, hasChunkRecords,
+                          markDocumentRevised, registerChunks, setSetting,
+                          updateChunkIndexes)
+from RAG.embedding_cache import CachedEmbeddings
+from RAG.embedding_utils import EMBEDDING_BACKEND, createEmbeddings
+from RAG.loader_utils import iterSplitBatches, loadAndSplitDocument
+from RAG.metrics_utils import timedIterator, timedStage
 
-# Initialize Chroma vector store
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embeddingFunction)
+# Number of chunks embedded and written to Chroma per call
+INDEX_BATCH_SIZE = int(os.getenv('INDEX_BATCH_SIZE', 64))
+BULK_INDEX_BATCH_SIZE = int(os.getenv('BULK_INDEX_BATCH_SIZE', 512))
 
+# With CHROMA_HOST set, Chroma is used through its HTTP client, so several
+# API workers (or hosts) share one store; otherwise it is embedded in-process
+CHROMA_HOST = os.getenv('CHROMA_HOST')
+CHROMA_PORT = int(os.getenv('CHROMA_PORT', 8001))
+CHROMA_PERSIST_DIR = os.getenv('CHROMA_PERSIST_DIR', './chroma_db')
 
-# --- Loading & Splitting Documents -------------------------------------
+# Parsing is CPU-bound, so multi-file uploads are parsed in separate processes
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', os.cpu_count() or 2))
+parsePool = None
 
-def loadAndSplitDocument(filepath: str) -> List[Document]:
-    if filepath.endswith('.pdf'):
-        loader = PyPDFLoader(filepath)
-    elif filepath.endswith('.docx'):
-        loader = Docx2txtLoader(filepath)
-    elif filepath.endswith('.html'):
-        loader = UnstructuredHTMLLoader(filepath)
-    elif filepath.endswith('.txt'):
-        loader = UnstructuredHTMLLoader(filepath)
-    else:
-        raise ValueError(f"Unsupported file type: {filepath}")
+# The embedder, the Chroma store and the lexical index are created on first
+# use (or during warm-up), so importing this module is cheap and needs no API key
+embeddingFunction = None
+vectorstore = None
+lexicalIndex = None
+storeLock = threading.RLock()
 
-    documents = loader.load()
-    return textSplitter.split_documents(documents)
+# Serialize concurrent (re-)indexing and deletion of the same document:
+# a threading lock within this process, and a lock file per document for
+# the other API workers on this host
+fileLocks = defaultdict(threading.Lock)
+fileLocksGuard = threading.Lock()
+DOCUMENT_LOCK_DIR = os.getenv('DOCUMENT_LOCK_DIR', 'locks')
 
 
-# --- Indexing Documents to Chroma --------------------------------------
+# --- Embedding Client & Stores -----------------------------------------
 
-def indexDocumentToChroma(filepath: str, fileId: int) -> bool:
-    try:
-        splits = loadAndSplitDocument(filepath)
-        
-        # Add metadata to each split
+def getEmbeddingFunction() -> CachedEmbeddings:
+    """
+    The configured embedding backend (EMBEDDING_BACKEND), wrapped in the
+    content-addressed cache that every embedding (ingestion and query) goes through
+    """
+    global embeddingFunction
+    if embeddingFunction is None:
+        with storeLock:
+            if embeddingFunction is None:
+                baseEmbeddings, modelName = createEmbeddings()
+                embeddingFunction = CachedEmbeddings(
+                    baseEmbeddings,
+                    modelName=modelName,
+                    dbPath=os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.db'),
+                    maxEntries=int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 200_000)),
+                )
+    return embeddingFunction
+
+
+def getVectorstore():
+    """
+    Open the Chroma store on first use: a Chroma server if CHROMA_HOST is
+    set, the embedded persistent store otherwise
+    """
+    global vectorstore
+    if vectorstore is None:
+        with storeLock:
+            if vectorstore is None:
+                # Imported here: chromadb alone takes about a second to import
+                from langchain_chroma import Chroma
+                if CHROMA_HOST:
+                    import chromadb
+                    storeOptions = {"client": chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)}
+                else:
+                    storeOptions = {"persist_directory": CHROMA_PERSIST_DIR}
+                # Vectors from different backends have different dimensions, so each
+                # non-default backend gets its own collection
+                vectorstore = Chroma(
+                    collection_name='langchain' if EMBEDDING_BACKEND == 'openai' else f'chatdocs_{EMBEDDING_BACKEND}',
+                    embedding_function=getEmbeddingFunction(),
+                    **storeOptions,
+                )
+    return vectorstore
+
+
+def reopenCollection():
+    """
+    Open the collection again after another worker dropped and recreated it
+    (see clearChromaStore); the old handle points at the dropped collection
+    """
+    with storeLock:
+        if vectorstore is not None:
+            vectorstore._chroma_collection = vectorstore._client.get_or_create_collection(
+                name=vectorstore._collection_name,
+                embedding_function=None,
+                metadata=vectorstore._collection_metadata,
+            )
+
+
+def getLexicalIndex() -> BM25Index:
+    """
+    Lexical (BM25) index over the same chunks, kept in sync with Chroma
+    """
+    global lexicalIndex
+    if lexicalIndex is None:
+        with storeLock:
+            if lexicalIndex is None:
+                lexicalIndex = BM25Index(os.getenv('BM25_INDEX_PATH', 'bm25_index.db'))
+    return lexicalIndex
+
+
+def resetEmbeddingClient():
+    """
+    Rebuild the embedding client, e.g. after the API key changes. The
+    embedding cache is kept, since vectors don't depend on the key.
+    """
+    with storeLock:
+        if embeddingFunction is not None:
+            embeddingFunction.underlying, _ = createEmbeddings()
+
+
+# --- Lexical Index -----------------------------------------------------
+
+def addChunks(batch):
+    """
+    Write a batch of splits to Chroma under new chunk ids. The ids are
+    registered first, so no vector is ever stored without a registry row
+    pointing at it. The lexical index picks the chunks up when the
+    document is committed; see ChunkReconciler.commit.
+    """
+    ids = []
+    for split in batch:
+        split.metadata['chunkId'] = str(uuid.uuid4())
+        ids.append(split.metadata['chunkId'])
+    registerChunks([(split.metadata['chunkId'], split.metadata['fileId'], split.metadata.get('chunkHash'),
+                     split.metadata.get('chunkIndex')) for split in batch])
+    with timedStage('ingest_store'):
+        getVectorstore().add_documents(documents=batch, ids=ids)
+
+
+def fetchChunks(chunkIds: List[str]) -> Iterator[Document]:
+    """
+    Read chunks back from Chroma by id, a batch at a time
+    """
+    for start in range(0, len(chunkIds), BULK_INDEX_BATCH_SIZE):
+        page = getVectorstore()._collection.get(ids=chunkIds[start:start + BULK_INDEX_BATCH_SIZE],
+                                                include=['documents', 'metadatas'])
+        for chunkId, text, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+            # Keyed by the Chroma id, also for chunks stored without a chunkId
+            yield Document(page_content=text, metadata={**(metadata or {}), 'chunkId': chunkId})
+
+
+def hasIndexedChunks(fileId: int) -> bool:
+    return hasChunkRecords(fileId)
+
+
+def syncChunkRegistry(pageSize: int = 1000):
+    """
+    Register chunks that are in Chroma but not in the registry, e.g. those
+    of a vector store created before the registry existed
+    """
+    if countChunkRecords() >= getVectorstore()._collection.count():
+        return
+
+    registered = getAllChunkRecords()
+    missing = 0
+    offset = 0
+    while True:
+        page = getVectorstore()._collection.get(limit=pageSize, offset=offset, include=['metadatas'])
+        if not page['ids']:
+            break
+        records = []
+        for chunkId, metadata in zip(page['ids'], page['metadatas']):
+            if chunkId not in registered:
+                metadata = metadata or {}
+                records.append((chunkId, metadata.get('fileId'), metadata.get('chunkHash'), metadata.get('chunkIndex')))
+        registerChunks(records)
+        missing += len(records)
+        offset += len(page['ids'])
+    print(f'Registered {missing} existing chunks')
+
+
+def syncLexicalIndex(pageSize: int = 1000):
+    """
+    Build the lexical index from Chroma when it is missing, e.g. for a
+    vector store created before the index existed
+    """
+    if len(getLexicalIndex()) or not getVectorstore()._collection.count():
+        return
+
+    # A page at a time, each read from Chroma before its lexical transaction.
+    # Adding a chunk twice replaces it, so workers building it at once agree.
+    offset = 0
+    while True:
+        page = getVectorstore()._collection.get(limit=pageSize, offset=offset, include=['documents', 'metadatas'])
+        if not page['ids']:
+            break
+        getLexicalIndex().add(Document(page_content=text, metadata={**(metadata or {}), 'chunkId': chunkId})
+                              for chunkId, text, metadata in zip(page['ids'], page['documents'], page['metadatas']))
+        offset += len(page['ids'])
+    print(f'Built lexical index over {len(getLexicalIndex())} chunks')
+
+
+# --- Incremental Re-Indexing -------------------------------------------
+
+@contextmanager
+def getFileLock(fileId: int):
+    with fileLocksGuard:
+        threadLock = fileLocks[fileId]
+    os.makedirs(DOCUMENT_LOCK_DIR, exist_ok=True)
+    with threadLock, FileLock(os.path.join(DOCUMENT_LOCK_DIR, f'document-{fileId}.lock')):
+        yield
+
+
+class ChunkReconciler:
+    """
+    Diffs a (re-)uploaded document against the chunks already indexed for
+    its fileId by content hash. Unchanged chunks keep their id and vector,
+    only new or changed splits are returned for embedding, and chunks that
+    no longer occur are deleted by id when the update is committed.
+
+    Existing chunks are not touched until `commit`, so the previous version
+    stays searchable while the new one is embedded and a failed update can
+    be rolled back by deleting just the chunks it added.
+    """
+
+    def __init__(self, fileId: int):
+        self.fileId = fileId
+        # Fetched by id from the registry rather than by a metadata scan
+        registeredIds = getChunkIds(fileId)
+        existing = {'ids': [], 'documents': [], 'metadatas': []}
+        for start in range(0, len(registeredIds), BULK_INDEX_BATCH_SIZE):
+            page = getVectorstore()._collection.get(ids=registeredIds[start:start + BULK_INDEX_BATCH_SIZE],
+                                                    include=['documents', 'metadatas'])
+            for key in existing:
+                existing[key].extend(page[key])
+        self.existingIds = set(registeredIds)
+        self.indexedIds = set(existing['ids'])
+        # Content hash -> [(chunkId, metadata)]; a text can occur more than once in a file
+        self.unmatched = defaultdict(list)
+        for chunkId, text, metadata in zip(existing['ids'], existing['documents'], existing['metadatas']):
+            metadata = metadata or {}
+            # Chunks indexed before chunk hashes existed
+            chunkHash = metadata.get('chunkHash') or hashChunkText(text)
+            self.unmatched[chunkHash].append((chunkId, metadata))
+        self.moved = []
+        self.reused = 0
+
+    @property
+    def isUpdate(self) -> bool:
+        return bool(self.indexedIds)
+
+    def reconcile(self, splits: List[Document]) -> List[Document]:
+        """
+        Match splits to indexed chunks; returns the splits that need embedding
+        """
+        fresh = []
         for split in splits:
-            split.metadata.update({
-                'fileId': fileId,
-                'source': filepath
-            })
+            chunkHash = hashChunkText(split.page_content)
+            split.metadata['chunkHash'] = chunkHash
+            candidates = self.unmatched.get(chunkHash)
+            if not candidates:
+                fresh.append(split)
+                continue
+            chunkId, metadata = candidates.pop()
+            split.metadata['chunkId'] = chunkId
+            self.reused += 1
+            # Same text, but e.g. its position in the file has shifted
+            if metadata != split.metadata:
+                self.moved.append(split)
+        return fresh
 
-        vectorstore.add_documents(documents=splits)
-        return True
+    def commit(self):
+        """
+        Apply metadata changes of reused chunks, delete the stale ones and
+        bring the lexical index up to date, in one lexical index transaction.
+        Chroma is read before that transaction starts, so it stays short.
+        """
+        for start in range(0, len(self.moved), BULK_INDEX_BATCH_SIZE):
+            batch = self.moved[start:start + BULK_INDEX_BATCH_SIZE]
+            getVectorstore()._collection.update(ids=[split.metadata['chunkId'] for split in batch],
+                                           metadatas=[split.metadata for split in batch])
+        updateChunkIndexes([(split.metadata['chunkIndex'], split.metadata['chunkId']) for split in self.moved])
+
+        staleIds = [chunkId for candidates in self.unmatched.values() for chunkId, _ in candidates]
+        # Registered ids whose vectors are gone are dropped from the registry too
+        staleIds += list(self.existingIds - self.indexedIds)
+        deleteChunksById(staleIds)
+
+        addedIds = [chunkId for chunkId in getChunkIds(self.fileId) if chunkId not in self.existingIds]
+        with timedStage('ingest_lexical'):
+            addedChunks = list(fetchChunks(addedIds))
+            with getLexicalIndex().transaction() as lexical:
+                lexical.add(addedChunks)
+                lexical.removeKeys(staleIds)
+
+        if self.isUpdate:
+            markDocumentRevised(self.fileId)
+            print(f'Re-indexed fileId {self.fileId}: {self.reused} chunks reused, '
+                  f'{len(self.moved)} moved, {len(staleIds)} removed')
+
+    def rollback(self):
+        """
+        Delete the chunks added since this reconciler was created. They
+        never reached the lexical index, which is only updated on commit.
+        """
+        addedIds = [chunkId for chunkId in getChunkIds(self.fileId) if chunkId not in self.existingIds]
+        deleteChunksById(addedIds)
+
+
+# --- Indexing Documents to Chroma --------------------------------------
+
+def indexDocumentToChroma(filepath: str, fileId: int, source: str | None = None,
+                          progressCallback: Callable[[str, int, int | None], None] | None = None) -> bool:
+    """
+    Load, split, embed and store a document. `progressCallback(status,
+    chunksEmbedded, totalChunks)` is called as the document moves through
+    the parsing and embedding stages; totalChunks is None until the whole
+    document has been read.
+
+    If the fileId already has chunks (a re-upload, or an interrupted run),
+    only new or changed chunks are embedded; see ChunkReconciler. On
+    failure the chunks added by this call are removed again.
+    """
+    def reportProgress(status: str, chunksEmbedded: int = 0, totalChunks: int | None = None):
+        if progressCallback:
+            progressCallback(status, chunksEmbedded, totalChunks)
+
+    with getFileLock(fileId):
+        reconciler = None
+        try:
+            reportProgress('parsing')
+            chunksEmbedded = 0
+            reconciler = ChunkReconciler(fileId)
+
+            # Splits are produced lazily and embedded batch by batch, so peak
+            # memory is bounded by the batch size rather than the file size
+            for batch in timedIterator(iterSplitBatches(filepath, INDEX_BATCH_SIZE), 'ingest_parse'):
+                # Add metadata to each split; chunkIndex is the split's position in the file
+                for position, split in enumerate(batch, start=chunksEmbedded):
+                    split.metadata.update({
+                        'fileId': fileId,
+                        'source': source or filepath,
+                        'chunkIndex': position
+                    })
+
+                fresh = reconciler.reconcile(batch)
+                if fresh:
+                    addChunks(fresh)
+                chunksEmbedded += len(batch)
+                reportProgress('embedding', chunksEmbedded, None)
+
+            reportProgress('embedding', chunksEmbedded, chunksEmbedded)
+            with timedStage('ingest_finalize'):
+                # Swap in the new version: one corpus version bump for the whole update
+                reconciler.commit()
+                bumpCorpusVersion()
+            return True
     
-    except Exception as e:
-        print(f"Error Indexing the document: {str(e)}")
-        return False
+        except Exception as e:
+            print(f"Error Indexing the document: {str(e)}")
+            if reconciler is not None:
+                try:
+                    reconciler.rollback()
+                except Exception as rollbackError:
+                    print(f"Error rolling back fileId {fileId}: {str(rollbackError)}")
+            return False
     
 
+def getParsePool() -> ProcessPoolExecutor:
+    """
+    Lazily start the process pool used to parse uploads in parallel
+    """
+    global parsePool
+    if parsePool is None:
+        # Spawn rather than fork: the API process holds threads and open SQLite/Chroma handles
+        parsePool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return parsePool
+
+
+def shutdownParsePool():
+    global parsePool
+    if parsePool is not None:
+        parsePool.shutdown(wait=False, cancel_futures=True)
+        parsePool = None
+
+
+def indexDocumentsToChroma(files: List[Tuple[str, int, str]], batchSize: int = BULK_INDEX_BATCH_SIZE) -> Dict[int, dict]:
+    """
+    Bulk-index several documents. `files` holds (filepath, fileId, source)
+    tuples. The files are parsed in parallel, their splits are merged into
+    batches of `batchSize` chunks for embedding, and a result is returned
+    per fileId. Files whose fileId is already indexed are updated
+    incrementally, as in indexDocumentToChroma.
+    """
+    results = {fileId: {"chunks": 0, "success": True, "error": None} for _, fileId, _ in files}
+    reconcilers = {}
+
+    pool = getParsePool()
+    futures = {fileId: (source, pool.submit(loadAndSplitDocument, filepath)) for filepath, fileId, source in files}
+
+    def flush(batch):
+        try:
+            addChunks(batch)
+        except Exception as e:
+            print(f"Error Indexing a batch of documents: {str(e)}")
+            for fileId in {split.metadata['fileId'] for split in batch}:
+                results[fileId].update(success=False, error=str(e))
+
+    # Like indexDocumentToChroma, hold each file's lock from reconciling it
+    # until its update is committed or rolled back. Taken in fileId order,
+    # so concurrent bulk uploads sharing files can't deadlock.
+    with ExitStack() as heldLocks:
+        for fileId in sorted(futures):
+            heldLocks.enter_context(getFileLock(fileId))
+
+        # Flush full batches as soon as each file is parsed, so only one batch
+        # plus the most recently parsed file are held in memory at a time
+        pending = []
+        for fileId, (source, future) in futures.items():
+            try:
+                # Parsing runs in the pool; this is the time spent waiting for it
+                with timedStage('ingest_parse_wait'):
+                    fileSplits = future.result()
+            except Exception as e:
+                print(f"Error parsing {source}: {str(e)}")
+                results[fileId].update(success=False, error=str(e))
+                continue
+
+            for position, split in enumerate(fileSplits):
+                split.metadata.update({
+                    'fileId': fileId,
+                    'source': source,
+                    'chunkIndex': position
+                })
+            results[fileId]["chunks"] = len(fileSplits)
+            try:
+                reconcilers[fileId] = ChunkReconciler(fileId)
+                pending.extend(reconcilers[fileId].reconcile(fileSplits))
+            except Exception as e:
+                print(f"Error reconciling {source}: {str(e)}")
+                results[fileId].update(success=False, error=str(e))
+                continue
+
+            while len(pending) >= batchSize:
+                flush(pending[:batchSize])
+                pending = pending[batchSize:]
+
+        if pending:
+            flush(pending)
+
+        with timedStage('ingest_finalize'):
+            for fileId, reconciler in reconcilers.items():
+                try:
+                    if results[fileId]["success"]:
+                        reconciler.commit()
+                    else:
+                        # Don't leave partially indexed documents behind; a previous version stays as it was
+                        reconciler.rollback()
+                except Exception as e:
+                    print(f"Error finalizing fileId {fileId}: {str(e)}")
+                    results[fileId].update(success=False, error=str(e))
+
+    if reconcilers:
+        bumpCorpusVersion()
+
+    return results
+
+
 # --- Deleting Documents from Chroma ------------------------------------
 
+def deleteChunksById(chunkIds: List[str]):
+    """
+    Delete chunks from Chroma and the registry by id. Callers remove them
+    from the lexical index inside a lexical index transaction.
+    """
+    for start in range(0, len(chunkIds), BULK_INDEX_BATCH_SIZE):
+        getVectorstore()._collection.delete(ids=chunkIds[start:start + BULK_INDEX_BATCH_SIZE])
+    deleteChunkRecords(chunkIds)
+
+
 def deleteDocumentFromChroma(fileId: int):
     try:
-        # Fix: Use correct metadata field name
-        vectorstore._collection.delete(where={'fileId': fileId})
+        with getFileLock(fileId):
+            chunkIds = getChunkIds(fileId)
+            deleteChunksById(chunkIds)
+            deleteChunkRecordsForFile(fileId)
+            with getLexicalIndex().transaction() as lexical:
+                lexical.removeKeys(chunkIds)
+                # Also drops lexical entries whose chunk was never registered
+                lexical.removeFile(fileId)
+        bumpCorpusVersion()
         print(f'Deleted all documents with fileId {fileId}')
         return True
 
@@ -70,10 +515,18 @@ def deleteDocumentFromChroma(fileId: int):
 
 def clearChromaStore():
     """
-    Clear all documents from Chroma
+    Clear all documents from Chroma. The collection is dropped and
+    recreated rather than deleted from chunk by chunk.
     """
     try:
-        vectorstore._collection.delete(where={})
+        with storeLock:
+            getVectorstore().reset_collection()
+        # Tells the other workers to reopen the collection
+        setSetting('collection_generation', str(uuid.uuid4()))
+        clearChunkRecords()
+        with getLexicalIndex().transaction() as lexical:
+            lexical.clear()
+        bumpCorpusVersion()
         print('Cleared all documents from Chroma')
         return True
     except Exception as e:
@@ -0,0 +1,129 @@
+import os
+import re
+from itertools import groupby
+from typing import List
+
+from langchain_core.documents import Document
+
+from RAG.token_utils import countTokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+# Trade-off between relevance and novelty when ordering candidates (1.0 = relevance only)
+MMR_LAMBDA = float(os.getenv('CONTEXT_MMR_LAMBDA', 0.7))
+# Candidates at least this similar to an already selected chunk are dropped
+DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', 0.8))
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+# --- Merging Adjacent Chunks -------------------------------------------
+
+def stitchText(text: str, previous: Document, following: Document) -> str:
+    """
+    Append chunk `following` to `text`, which ends with chunk `previous`.
+    When their startIndex offsets show that the two overlap, the shared
+    text is kept once; otherwise (no overlap, e.g. across a page break, or
+    chunks stored without offsets) they are joined with a newline.
+    """
+    previousStart = previous.metadata.get('startIndex')
+    followingStart = following.metadata.get('startIndex')
+    if previousStart is not None and followingStart is not None:
+        overlap = previousStart + len(previous.page_content) - followingStart
+        if 0 < overlap <= len(following.page_content) and text.endswith(following.page_content[:overlap]):
+            return text + following.page_content[overlap:]
+    return f'{text}\n{following.page_content}'
+
+
+def mergeRun(run):
+    """
+    Stitch a run of consecutive (rank, chunk) pairs into one chunk
+    """
+    if len(run) == 1:
+        return run[0]
+    text = run[0][1].page_content
+    for (_, previous), (_, following) in zip(run, run[1:]):
+        text = stitchText(text, previous, following)
+    metadata = dict(run[0][1].metadata)
+    metadata['chunkIndexEnd'] = run[-1][1].metadata['chunkIndex']
+    return min(rank for rank, _ in run), Document(page_content=text, metadata=metadata)
+
+
+def mergeAdjacentChunks(documents: List[Document]) -> List[Document]:
+    """
+    Merge retrieved chunks that are consecutive in the same file. The
+    merged chunk takes the rank of its best-ranked member.
+    """
+    ranked = list(enumerate(documents))
+    mergeable = [(rank, doc) for rank, doc in ranked
+                 if 'chunkIndex' in doc.metadata and 'fileId' in doc.metadata]
+    merged = [(rank, doc) for rank, doc in ranked
+              if 'chunkIndex' not in doc.metadata or 'fileId' not in doc.metadata]
+
+    def position(item):
+        return item[1].metadata['fileId'], item[1].metadata['chunkIndex']
+
+    for _, group in groupby(sorted(mergeable, key=position), key=lambda item: item[1].metadata['fileId']):
+        run = []
+        for item in group:
+            # The same chunk can come back from both retrievers; the better-ranked copy is kept
+            if run and item[1].metadata['chunkIndex'] == run[-1][1].metadata['chunkIndex']:
+                continue
+            if run and item[1].metadata['chunkIndex'] != run[-1][1].metadata['chunkIndex'] + 1:
+                merged.append(mergeRun(run))
+                run = []
+            run.append(item)
+        if run:
+            merged.append(mergeRun(run))
+
+    return [doc for _, doc in sorted(merged, key=lambda item: item[0])]
+
+
+# --- Redundancy-Aware Selection ----------------------------------------
+
+def wordSet(text: str) -> frozenset:
+    return frozenset(WORD_PATTERN.findall(text.lower()))
+
+
+def similarity(first: frozenset, second: frozenset) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def packContext(documents: List[Document], budget: int = CONTEXT_TOKEN_BUDGET,
+                mmrLambda: float = MMR_LAMBDA, duplicateThreshold: float = DUPLICATE_THRESHOLD) -> List[Document]:
+    """
+    Assemble the prompt context from over-fetched, relevance-ordered
+    candidates: merge adjacent chunks, then pick chunks MMR-style (by
+    relevance, penalised by similarity to what is already picked), skip
+    near-duplicates, and stop adding once the token budget is full.
+    """
+    candidates = mergeAdjacentChunks(documents)
+    if not candidates:
+        return []
+
+    words = [wordSet(doc.page_content) for doc in candidates]
+    # Candidates arrive best first; turn rank into a relevance score in (0, 1]
+    relevance = [1 - rank / len(candidates) for rank in range(len(candidates))]
+
+    selected, usedTokens = [], 0
+    remaining = list(range(len(candidates)))
+    while remaining:
+        def mmrScore(i):
+            redundancy = max((similarity(words[i], words[j]) for j in selected), default=0.0)
+            return mmrLambda * relevance[i] - (1 - mmrLambda) * redundancy
+
+        best = max(remaining, key=mmrScore)
+        remaining.remove(best)
+
+        if any(similarity(words[best], words[j]) >= duplicateThreshold for j in selected):
+            continue
+        tokens = countTokens(candidates[best].page_content)
+        if usedTokens + tokens > budget:
+            # Always include at least the most relevant chunk
+            if selected:
+                continue
+        selected.append(best)
+        usedTokens += tokens
+
+    return [candidates[i] for i in selected]
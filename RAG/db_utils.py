@@ -1,6 +1,28 @@
+import asyncio
+import atexit
+import os
+import queue
 import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from filelock import FileLock
 
 DB_NAME = 'chatDocs.db'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+
+# Idle connections, reused instead of reconnecting for every statement
+connectionPool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+# Tables are created on first use rather than at import time
+databaseReady = False
+databaseLock = threading.Lock()
+
+# Chat turns are buffered and written in one transaction per batch
+LOG_FLUSH_BATCH_SIZE = int(os.getenv('LOG_FLUSH_BATCH_SIZE', 100))
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', 1.0))
 
 # --- Establish Connection ----------------------------------------------
 
@@ -8,101 +30,458 @@ def getDbConnection():
     """
     Establishes connection with the SQLite database
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, timeout=30)
     # conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed while a write is in progress; NORMAL sync is durable under WAL
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
     return conn
 
+@contextmanager
+def pooledConnection():
+    """
+    Borrow a connection from the pool, creating the tables on first use
+    """
+    if not databaseReady:
+        initDatabase()
+    with borrowConnection() as conn:
+        yield conn
+
+@contextmanager
+def borrowConnection():
+    """
+    Borrow a connection from the pool, returning it when done
+    """
+    try:
+        conn = connectionPool.get_nowait()
+    except queue.Empty:
+        conn = getDbConnection()
+
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            connectionPool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def closeDbConnections():
+    """
+    Close all idle pooled connections
+    """
+    while True:
+        try:
+            connectionPool.get_nowait().close()
+        except queue.Empty:
+            break
+
 
 # --- Create Tables ------------------------------------------------------
 
+def initDatabase():
+    """
+    Create the tables if they don't already exist. Runs once, on first use.
+    """
+    global databaseReady
+    # The file lock keeps several API workers from migrating the schema at once
+    with databaseLock, FileLock(f'{DB_NAME}.lock'):
+        if databaseReady:
+            return
+        createApplicationLogs()
+        createSessionSummaries()
+        createDocumentStore()
+        createIngestionJobs()
+        createCorpusState()
+        createDocumentChunks()
+        createAppSettings()
+        databaseReady = True
+
 def createApplicationLogs():
     """
     Stores chat history and model responses
     """
-    conn = getDbConnection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS application_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sessionId TEXT,
-            userQuery TEXT,
-            response TEXT,
-            model TEXT,
-            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )'''
-    )
-    conn.close()
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS application_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sessionId TEXT,
+                userQuery TEXT,
+                response TEXT,
+                model TEXT,
+                createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+        )
+        # turnId identifies a turn while it is still buffered in the log sink
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(application_logs)')}
+        if 'turnId' not in columns:
+            conn.execute('ALTER TABLE application_logs ADD COLUMN turnId TEXT')
+            conn.commit()
+        # History lookups filter by session and order by time
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_application_logs_session ON application_logs (sessionId, createdAt)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_application_logs_createdAt ON application_logs (createdAt)')
+
+def createSessionSummaries():
+    """
+    Rolling summary of the older turns of each chat session
+    """
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS session_summaries (
+                sessionId TEXT PRIMARY KEY,
+                summary TEXT,
+                summarizedTurns INTEGER DEFAULT 0,
+                updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+        )
 
 def createDocumentStore():
     """
     Keeps track of the uploaded documents
     """
-    conn = getDbConnection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS document_store (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT,
-            uploadTimestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )'''
-    )
-    conn.close()
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_store (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT,
+                uploadTimestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+        )
+        # version counts re-uploads of the same document that were indexed incrementally
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(document_store)')}
+        if 'version' not in columns:
+            conn.execute('ALTER TABLE document_store ADD COLUMN version INTEGER DEFAULT 1')
+        # sha256 of the uploaded bytes, so identical uploads are not indexed twice
+        if 'contentHash' not in columns:
+            conn.execute('ALTER TABLE document_store ADD COLUMN contentHash TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_document_store_filename ON document_store (filename)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_document_store_contentHash ON document_store (contentHash)')
+        conn.commit()
+
+def createIngestionJobs():
+    """
+    Tracks background ingestion jobs for uploaded documents
+    """
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT,
+                spoolPath TEXT,
+                fileId INTEGER REFERENCES document_store(id),
+                status TEXT DEFAULT 'queued',
+                chunksEmbedded INTEGER DEFAULT 0,
+                totalChunks INTEGER,
+                error TEXT,
+                createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+        )
+        # The API process running the job, so a restarted worker only resumes jobs whose process is gone
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(ingestion_jobs)')}
+        if 'owner' not in columns:
+            conn.execute('ALTER TABLE ingestion_jobs ADD COLUMN owner TEXT')
+        conn.commit()
+
+def createCorpusState():
+    """
+    Holds the corpus version, bumped whenever the indexed documents change
+    """
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS corpus_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+                )'''
+        )
+        conn.execute('INSERT OR IGNORE INTO corpus_state (id, version) VALUES (1, 0)')
+        conn.commit()
+
+def createDocumentChunks():
+    """
+    Registry of the chunk ids each document has in the vector store, so
+    deletes and consistency checks never have to scan Chroma by metadata
+    """
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                chunkId TEXT PRIMARY KEY,
+                fileId INTEGER NOT NULL,
+                chunkHash TEXT,
+                chunkIndex INTEGER
+                )'''
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_document_chunks_fileId ON document_chunks (fileId)')
+        conn.commit()
+
+def createAppSettings():
+    """
+    Settings and credentials shared by all API workers, e.g. the API key
+    """
+    with borrowConnection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS app_settings (
+                name TEXT PRIMARY KEY,
+                value TEXT,
+                updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+        )
+        conn.commit()
+
+
+# --- Write-Behind Log Sink ----------------------------------------------
+
+class ApplicationLogSink:
+    """
+    Buffers completed chat turns in memory and writes them to
+    application_logs in batched transactions, once `batchSize` turns are
+    waiting or every `flushInterval` seconds, whichever comes first.
+
+    Turns stay visible to `pendingTurns` until their batch is committed, so
+    a session always reads its own writes.
+    """
+
+    def __init__(self, batchSize: int = LOG_FLUSH_BATCH_SIZE, flushInterval: float = LOG_FLUSH_INTERVAL):
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self._pending = []
+        self._inFlight = []
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def _ensureStarted(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+            self._thread.start()
+
+    def append(self, sessionId, userQuery, response, model):
+        # Same format as SQLite's CURRENT_TIMESTAMP, taken when the turn completed
+        createdAt = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        turn = (uuid.uuid4().hex, sessionId, userQuery, response, model, createdAt)
+        with self._lock:
+            self._pending.append(turn)
+            writeThrough = self._stopped
+            if not writeThrough:
+                self._ensureStarted()
+                if len(self._pending) >= self.batchSize:
+                    self._wakeup.set()
+        if writeThrough:
+            # The background writer has been stopped
+            self.flush()
+
+    def pendingTurns(self, sessionId):
+        """
+        Turns of a session that may not be committed yet, oldest first
+        """
+        with self._lock:
+            return [turn for turn in self._inFlight + self._pending if turn[1] == sessionId]
+
+    def discardSession(self, sessionId):
+        with self._lock:
+            self._pending = [turn for turn in self._pending if turn[1] != sessionId]
+
+    def flush(self):
+        """
+        Write all buffered turns in a single transaction
+        """
+        with self._flushLock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._inFlight = batch
+            if not batch:
+                return
+
+            try:
+                with pooledConnection() as conn:
+                    conn.executemany('''
+                        INSERT INTO application_logs (turnId, sessionId, userQuery, response, model, createdAt)
+                        VALUES (?, ?, ?, ?, ?, ?)''', batch)
+                    conn.commit()
+            except Exception as e:
+                print(f"Error flushing application logs: {str(e)}")
+                # Keep the turns for the next attempt
+                with self._lock:
+                    self._pending = batch + self._pending
+            finally:
+                with self._lock:
+                    self._inFlight = []
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flushInterval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """
+        Stop the background writer and flush whatever is left
+        """
+        with self._lock:
+            self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+
+logSink = ApplicationLogSink()
+atexit.register(logSink.close)
 
 
 # --- Managing Chat Logs -------------------------------------------------
 
 def insertApplicationLogs(sessionId, userQuery, response, model):
     """
-    Insert a record of the chat history
+    Insert a record of the chat history. The write is buffered by the log
+    sink and committed in the background.
     """
-    conn = getDbConnection()
-    conn.execute('INSERT INTO application_logs (sessionId, userQuery, response, model) VALUES (?, ?, ?, ?)', 
-                 (sessionId, userQuery, response, model))
-    conn.commit()
-    conn.close()
+    logSink.append(sessionId, userQuery, response, model)
 
 def getChatHistory(sessionId):
     """
-    Get the chat history of a session
+    Get the chat history of a session, including turns not yet flushed
     """
-    conn = getDbConnection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT userQuery, response FROM application_logs WHERE sessionId = ? ORDER BY createdAt', 
-                   (sessionId,))
+    # Snapshot buffered turns before reading, so a batch committed in
+    # between shows up in the query and is de-duplicated by turnId
+    pending = logSink.pendingTurns(sessionId)
+
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        # Served by idx_application_logs_session; id breaks ties within the same second
+        cursor.execute('SELECT userQuery, response, turnId FROM application_logs WHERE sessionId = ? ORDER BY createdAt, id', 
+                       (sessionId,))
+        rows = cursor.fetchall()
+
+    storedTurnIds = {row[2] for row in rows}
+    rows.extend((turn[2], turn[3], turn[0]) for turn in pending if turn[0] not in storedTurnIds)
     
     messages = []
-    for row in cursor.fetchall():
+    for row in rows:
         # Convert row tuple to proper message format
         messages.extend([
             {"type": "human", "content": row[0]},
             {"type": "ai", "content": row[1]}
         ])
     
-    conn.close()
     return messages
 
 
+# --- Session Summaries -------------------------------------------------
+
+def getSessionSummary(sessionId):
+    """
+    Get (summary, summarizedTurns) for a session; ('', 0) if there is none
+    """
+    with pooledConnection() as conn:
+        row = conn.execute('SELECT summary, summarizedTurns FROM session_summaries WHERE sessionId = ?',
+                           (sessionId,)).fetchone()
+    return row if row else ('', 0)
+
+def upsertSessionSummary(sessionId, summary, summarizedTurns):
+    """
+    Store the summary covering the first `summarizedTurns` turns of a session
+    """
+    with pooledConnection() as conn:
+        conn.execute('''
+            INSERT INTO session_summaries (sessionId, summary, summarizedTurns) VALUES (?, ?, ?)
+            ON CONFLICT(sessionId) DO UPDATE SET
+                summary = excluded.summary,
+                summarizedTurns = excluded.summarizedTurns,
+                updatedAt = CURRENT_TIMESTAMP
+        ''', (sessionId, summary, summarizedTurns))
+        conn.commit()
+
+
+# --- Async Interface ---------------------------------------------------
+# SQLite calls block, so async handlers run them on worker threads
+
+async def agetChatHistory(sessionId):
+    return await asyncio.to_thread(getChatHistory, sessionId)
+
+async def ainsertApplicationLogs(sessionId, userQuery, response, model):
+    # Only appends to the in-memory buffer, so no thread hop is needed
+    insertApplicationLogs(sessionId, userQuery, response, model)
+
+async def aclearSessionLogs(sessionId):
+    return await asyncio.to_thread(clearSessionLogs, sessionId)
+
+
 # --- Manage Document Records -------------------------------------------
 
 def insertDocumentRecord(filename):
     """
     Insert a record of the uploaded document
     """
-    conn = getDbConnection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
-    fileId = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
+        fileId = cursor.lastrowid
+        conn.commit()
     return fileId
 
+def getDocumentIdByFilename(filename):
+    """
+    Id of the most recent document uploaded under this filename, or None
+    """
+    with pooledConnection() as conn:
+        row = conn.execute('SELECT id FROM document_store WHERE filename = ? ORDER BY id DESC LIMIT 1',
+                           (filename,)).fetchone()
+    return row[0] if row else None
+
+def getOrInsertDocumentRecord(filename):
+    """
+    Id of the most recent document uploaded under this filename, inserting
+    a record if there is none. The write lock is taken before the lookup,
+    so two API workers can't both insert a record for one filename.
+    """
+    with pooledConnection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT id FROM document_store WHERE filename = ? ORDER BY id DESC LIMIT 1',
+                           (filename,)).fetchone()
+        fileId = row[0] if row else conn.execute('INSERT INTO document_store (filename) VALUES (?)',
+                                                 (filename,)).lastrowid
+        conn.commit()
+    return fileId
+
+def getDocumentIdByHash(contentHash):
+    """
+    Id of an indexed document with exactly these contents, or None
+    """
+    with pooledConnection() as conn:
+        row = conn.execute('SELECT id FROM document_store WHERE contentHash = ? ORDER BY id LIMIT 1',
+                           (contentHash,)).fetchone()
+    return row[0] if row else None
+
+def setDocumentHash(fileId, contentHash):
+    """
+    Record the content hash of a document once it has been indexed
+    """
+    with pooledConnection() as conn:
+        conn.execute('UPDATE document_store SET contentHash = ? WHERE id = ?', (contentHash, fileId))
+        conn.commit()
+
+def markDocumentRevised(fileId):
+    """
+    Record that a new version of the document has been indexed
+    """
+    with pooledConnection() as conn:
+        conn.execute('UPDATE document_store SET version = version + 1, uploadTimestamp = CURRENT_TIMESTAMP WHERE id = ?',
+                     (fileId,))
+        conn.commit()
+
 def deleteDocumentRecord(fileId):
     """
     Delete the record of a uploaded document
     """
     try:
-        conn = getDbConnection()
-        conn.execute('DELETE FROM document_store WHERE id = ?', (fileId,))
-        conn.commit()
-        conn.close()
+        with pooledConnection() as conn:
+            conn.execute('DELETE FROM document_store WHERE id = ?', (fileId,))
+            conn.commit()
         return True
     
     except:
@@ -112,15 +491,14 @@ def getAllDocuments():
     """
     Get all unique documents
     """
-    conn = getDbConnection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT DISTINCT id, filename, uploadTimestamp 
-        FROM document_store 
-        ORDER BY uploadTimestamp DESC
-    ''')
-    documents = cursor.fetchall()
-    conn.close()
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT id, filename, uploadTimestamp, version 
+            FROM document_store 
+            ORDER BY uploadTimestamp DESC
+        ''')
+        documents = cursor.fetchall()
     
     # Convert tuples to dictionaries, ensuring uniqueness by id
     seen_ids = set()
@@ -131,7 +509,8 @@ def getAllDocuments():
             unique_docs.append({
                 "id": doc[0],
                 "filename": doc[1], 
-                "uploadTimestamp": doc[2]
+                "uploadTimestamp": doc[2],
+                "version": doc[3]
             })
     
     return unique_docs
@@ -141,10 +520,9 @@ def clearDocumentStore():
     Clear all records from the document store
     """
     try:
-        conn = getDbConnection()
-        conn.execute('DELETE FROM document_store')
-        conn.commit()
-        conn.close()
+        with pooledConnection() as conn:
+            conn.execute('DELETE FROM document_store')
+            conn.commit()
         return True
     except Exception as e:
         print(f"Error clearing document store: {str(e)}")
@@ -155,15 +533,191 @@ def clearSessionLogs(sessionId):
     Clear all chat logs for a specific session
     """
     try:
-        conn = getDbConnection()
-        conn.execute('DELETE FROM application_logs WHERE sessionId = ?', (sessionId,))
-        conn.commit()
-        conn.close()
+        # Drop buffered turns too, otherwise they would be flushed after the delete
+        logSink.discardSession(sessionId)
+        logSink.flush()
+        with pooledConnection() as conn:
+            conn.execute('DELETE FROM application_logs WHERE sessionId = ?', (sessionId,))
+            conn.execute('DELETE FROM session_summaries WHERE sessionId = ?', (sessionId,))
+            conn.commit()
         return True
     except Exception as e:
         print(f"Error clearing session logs: {str(e)}")
         return False
 
-# Ensuring that our tables are created when the application starts, if they don't already exist.
-createApplicationLogs()
-createDocumentStore()
+
+# --- Chunk Registry ----------------------------------------------------
+
+def registerChunks(records):
+    """
+    Record (chunkId, fileId, chunkHash, chunkIndex) rows for indexed chunks
+    """
+    with pooledConnection() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO document_chunks (chunkId, fileId, chunkHash, chunkIndex)
+            VALUES (?, ?, ?, ?)
+        ''', records)
+        conn.commit()
+
+def updateChunkIndexes(records):
+    """
+    Update the position of reused chunks, given (chunkIndex, chunkId) pairs
+    """
+    with pooledConnection() as conn:
+        conn.executemany('UPDATE document_chunks SET chunkIndex = ? WHERE chunkId = ?', records)
+        conn.commit()
+
+def getChunkIds(fileId):
+    """
+    Ids of the chunks indexed for a document, in document order
+    """
+    with pooledConnection() as conn:
+        rows = conn.execute('SELECT chunkId FROM document_chunks WHERE fileId = ? ORDER BY chunkIndex',
+                            (fileId,)).fetchall()
+    return [row[0] for row in rows]
+
+def hasChunkRecords(fileId):
+    with pooledConnection() as conn:
+        row = conn.execute('SELECT 1 FROM document_chunks WHERE fileId = ? LIMIT 1', (fileId,)).fetchone()
+    return row is not None
+
+def countChunkRecords():
+    with pooledConnection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM document_chunks').fetchone()[0]
+
+def getAllChunkRecords():
+    """
+    Map of every registered chunk id to its document id
+    """
+    with pooledConnection() as conn:
+        rows = conn.execute('SELECT chunkId, fileId FROM document_chunks').fetchall()
+    return dict(rows)
+
+def deleteChunkRecords(chunkIds):
+    with pooledConnection() as conn:
+        conn.executemany('DELETE FROM document_chunks WHERE chunkId = ?', ((chunkId,) for chunkId in chunkIds))
+        conn.commit()
+
+def deleteChunkRecordsForFile(fileId):
+    with pooledConnection() as conn:
+        conn.execute('DELETE FROM document_chunks WHERE fileId = ?', (fileId,))
+        conn.commit()
+
+def clearChunkRecords():
+    with pooledConnection() as conn:
+        conn.execute('DELETE FROM document_chunks')
+        conn.commit()
+
+def getAllDocumentIds():
+    with pooledConnection() as conn:
+        rows = conn.execute('SELECT id FROM document_store').fetchall()
+    return {row[0] for row in rows}
+
+
+# --- Shared Settings ---------------------------------------------------
+
+def getSettings():
+    """
+    All shared settings, by name
+    """
+    with pooledConnection() as conn:
+        rows = conn.execute('SELECT name, value FROM app_settings').fetchall()
+    return dict(rows)
+
+def setSetting(name, value):
+    with pooledConnection() as conn:
+        conn.execute('''
+            INSERT INTO app_settings (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value, updatedAt = CURRENT_TIMESTAMP
+        ''', (name, value))
+        conn.commit()
+
+
+# --- Corpus Version ----------------------------------------------------
+
+def getCorpusVersion():
+    """
+    Get the current corpus version
+    """
+    with pooledConnection() as conn:
+        version = conn.execute('SELECT version FROM corpus_state WHERE id = 1').fetchone()[0]
+    return version
+
+def bumpCorpusVersion():
+    """
+    Increment the corpus version after the indexed documents change
+    """
+    with pooledConnection() as conn:
+        conn.execute('UPDATE corpus_state SET version = version + 1 WHERE id = 1')
+        conn.commit()
+
+
+# --- Manage Ingestion Jobs ---------------------------------------------
+
+INGESTION_JOB_FIELDS = ('id', 'filename', 'spoolPath', 'fileId', 'status',
+                        'chunksEmbedded', 'totalChunks', 'error', 'createdAt', 'updatedAt', 'owner')
+JOB_STATES = ('queued', 'parsing', 'embedding', 'stored', 'failed')
+
+def insertIngestionJob(jobId, filename, spoolPath, owner=None):
+    """
+    Insert a queued ingestion job
+    """
+    with pooledConnection() as conn:
+        conn.execute('INSERT INTO ingestion_jobs (id, filename, spoolPath, owner) VALUES (?, ?, ?, ?)',
+                     (jobId, filename, spoolPath, owner))
+        conn.commit()
+
+def claimIngestionJob(jobId, owner, previousOwner):
+    """
+    Take over an unfinished job, unless another process claimed it first.
+    Returns whether the claim succeeded.
+    """
+    with pooledConnection() as conn:
+        cursor = conn.execute('''
+            UPDATE ingestion_jobs
+            SET owner = ?, status = 'queued', chunksEmbedded = 0, updatedAt = CURRENT_TIMESTAMP
+            WHERE id = ? AND owner IS ? AND status NOT IN ('stored', 'failed')
+        ''', (owner, jobId, previousOwner))
+        conn.commit()
+    return cursor.rowcount == 1
+
+def updateIngestionJob(jobId, **fields):
+    """
+    Update the status and/or progress columns of an ingestion job
+    """
+    unknown = set(fields) - set(INGESTION_JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown ingestion job fields: {', '.join(sorted(unknown))}")
+    if 'status' in fields and fields['status'] not in JOB_STATES:
+        raise ValueError(f"Unknown ingestion job status: {fields['status']}")
+
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    with pooledConnection() as conn:
+        conn.execute(f'UPDATE ingestion_jobs SET {assignments}, updatedAt = CURRENT_TIMESTAMP WHERE id = ?',
+                     (*fields.values(), jobId))
+        conn.commit()
+
+def getIngestionJob(jobId):
+    """
+    Get a single ingestion job, or None if it does not exist
+    """
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT {", ".join(INGESTION_JOB_FIELDS)} FROM ingestion_jobs WHERE id = ?', (jobId,))
+        row = cursor.fetchone()
+    return dict(zip(INGESTION_JOB_FIELDS, row)) if row else None
+
+def getUnfinishedIngestionJobs():
+    """
+    Get the jobs that were queued or in progress, oldest first
+    """
+    with pooledConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {", ".join(INGESTION_JOB_FIELDS)}
+            FROM ingestion_jobs
+            WHERE status NOT IN ('stored', 'failed')
+            ORDER BY createdAt
+        ''')
+        jobs = [dict(zip(INGESTION_JOB_FIELDS, row)) for row in cursor.fetchall()]
+    return jobs
@@ -0,0 +1,136 @@
+import array
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from RAG.metrics_utils import timedStage, tokensTotal
+from RAG.token_utils import countTokens
+
+CACHE_DB_NAME = 'embedding_cache.db'
+# Part of every key, so rows stored in an older vector format are never read
+VECTOR_FORMAT = 'f32'
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+# --- Content-Addressed Embedding Cache ---------------------------------
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed embedding cache wrapping another embedding function.
+
+    Vectors are keyed by a hash of the embedding model name and the chunk
+    text, so identical chunks are only ever embedded once per model. They
+    are stored as float32, the precision Chroma keeps them in anyway: 6 KB
+    per 1536-dimensional vector. The cache holds at most `maxEntries`
+    vectors and evicts the least recently used ones when it grows past that.
+    """
+
+    def __init__(self, underlying: Embeddings, modelName: str,
+                 dbPath: str = CACHE_DB_NAME, maxEntries: int = DEFAULT_MAX_ENTRIES):
+        self.underlying = underlying
+        self.modelName = modelName
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(dbPath, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                vector BLOB,
+                lastAccess REAL
+                )'''
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embedding_cache_lastAccess ON embedding_cache (lastAccess)')
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f'{self.modelName}\0{VECTOR_FORMAT}\0{text}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _pack(vector: List[float]) -> bytes:
+        return array.array('f', vector).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        vector = array.array('f')
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f'SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})', batch
+            ).fetchall()
+            found.update((key, self._unpack(blob)) for key, blob in rows)
+        return found
+
+    def _evict(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        overflow = count - self.maxEntries
+        if overflow > 0:
+            self._conn.execute('''
+                DELETE FROM embedding_cache WHERE key IN (
+                    SELECT key FROM embedding_cache ORDER BY lastAccess LIMIT ?
+                )''', (overflow,))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+
+        with self._lock:
+            cached = self._lookup(list(set(keys)))
+
+        # Embed each distinct missing text once, even if it repeats in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        computed = {}
+        if missing:
+            with timedStage('embed'):
+                vectors = self.underlying.embed_documents(list(missing.values()))
+            tokensTotal.inc(sum(countTokens(text) for text in missing.values()), kind='embedding', model=self.modelName)
+            computed = dict(zip(missing.keys(), vectors))
+
+        now = time.time()
+        with self._lock:
+            self.hits += sum(1 for key in keys if key in cached)
+            self.misses += sum(1 for key in keys if key not in cached)
+            if cached:
+                self._conn.executemany('UPDATE embedding_cache SET lastAccess = ? WHERE key = ?',
+                                       [(now, key) for key in cached])
+            if computed:
+                self._conn.executemany('INSERT OR REPLACE INTO embedding_cache (key, vector, lastAccess) VALUES (?, ?, ?)',
+                                       [(key, self._pack(vector), now) for key, vector in computed.items()])
+                self._evict()
+            self._conn.commit()
+
+        return [cached[key] if key in cached else computed[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters and current size of the cache
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "maxEntries": self.maxEntries,
+        }
@@ -0,0 +1,106 @@
+import os
+import re
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')
+LOCAL_EMBEDDING_DIM = int(os.getenv('LOCAL_EMBEDDING_DIM', 384))
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+# --- Local Hashing Embedder --------------------------------------------
+
+class HashingEmbeddings(Embeddings):
+    """
+    Offline, deterministic embedder. Word unigrams, word bigrams and
+    character trigrams are feature-hashed (signed) into `hashDim` buckets,
+    projected down to `dim` with a fixed-seed Gaussian random projection
+    and L2-normalised. A batch is embedded with one matrix product.
+
+    Texts that share vocabulary end up close together. That is not a
+    semantic model, but it is good enough for air-gapped deployments, bulk
+    pre-indexing and reproducible performance tests.
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, hashDim: int = 2 ** 12, seed: int = 0):
+        self.dim = dim
+        self.hashDim = hashDim
+        self.model = f'local-hashing-{dim}'
+        rng = np.random.default_rng(seed)
+        self.projection = (rng.standard_normal((hashDim, dim)) / np.sqrt(dim)).astype(np.float32)
+
+    @staticmethod
+    def features(text: str) -> List[str]:
+        words = TOKEN_PATTERN.findall(text.lower())
+        features = list(words)
+        features.extend(f'{first} {second}' for first, second in zip(words, words[1:]))
+        for word in words:
+            padded = f'#{word}#'
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def hashedCounts(self, texts: List[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                # crc32 rather than hash(): Python's string hash is salted per process
+                digest = zlib.crc32(feature.encode('utf-8'))
+                rows.append(row)
+                columns.append(digest % self.hashDim)
+                signs.append(1.0 if digest & 0x80000000 else -1.0)
+
+        counts = np.zeros((len(texts), self.hashDim), dtype=np.float32)
+        np.add.at(counts, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)),
+                  np.asarray(signs, dtype=np.float32))
+        # Dampen very frequent features
+        return np.sign(counts) * np.log1p(np.abs(counts))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self.hashedCounts(texts) @ self.projection
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# --- Backend Registry --------------------------------------------------
+
+def createOpenAIEmbeddings() -> Tuple[Embeddings, str]:
+    # Imported here so the local backend works without the OpenAI client or a key
+    from langchain_openai import OpenAIEmbeddings
+    embeddings = OpenAIEmbeddings()
+    return embeddings, embeddings.model
+
+def createLocalEmbeddings() -> Tuple[Embeddings, str]:
+    embeddings = HashingEmbeddings()
+    return embeddings, embeddings.model
+
+embeddingBackends: Dict[str, Callable[[], Tuple[Embeddings, str]]] = {
+    'openai': createOpenAIEmbeddings,
+    'local': createLocalEmbeddings,
+}
+
+def registerEmbeddingBackend(name: str, factory: Callable[[], Tuple[Embeddings, str]]):
+    """
+    Make another embedding backend selectable through EMBEDDING_BACKEND.
+    The factory returns the embeddings object and its model name.
+    """
+    embeddingBackends[name] = factory
+
+def createEmbeddings(backend: str = EMBEDDING_BACKEND) -> Tuple[Embeddings, str]:
+    """
+    Build the configured embedding backend; returns (embeddings, modelName)
+    """
+    try:
+        factory = embeddingBackends[backend]
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend: {backend}. Available: {', '.join(embeddingBackends)}")
+    return factory()
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from typing import List
+
+from RAG.db_utils import getChatHistory, getSessionSummary, upsertSessionSummary
+from RAG.langchain_utils import getSummaryChain
+from RAG.token_utils import countTokens
+
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 2000))
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'gpt-4o-mini')
+
+# When folding, shrink the verbatim history to this share of the budget so
+# that the summary is not rewritten on every single new turn
+FOLD_TARGET_RATIO = 0.5
+
+
+# --- Budgeted History --------------------------------------------------
+
+def countTurnTokens(turn) -> int:
+    # A few tokens of per-message overhead on top of the content
+    return sum(countTokens(message["content"]) + 4 for message in turn)
+
+def groupTurns(messages: List[dict]) -> List[List[dict]]:
+    """
+    Group the flat human/ai message list into [human, ai] turns
+    """
+    return [messages[i:i + 2] for i in range(0, len(messages), 2)]
+
+def formatTurns(turns) -> str:
+    return '\n'.join(f'{message["type"]}: {message["content"]}' for turn in turns for message in turn)
+
+def newestTurnsWithin(turns, budget: int) -> int:
+    """
+    Number of trailing turns whose tokens fit in the budget
+    """
+    used, kept = 0, 0
+    for turn in reversed(turns):
+        used += countTurnTokens(turn)
+        if used > budget:
+            break
+        kept += 1
+    return kept
+
+def getBudgetedHistory(sessionId, budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
+    """
+    Chat history for the prompt: the most recent turns that fit in the
+    token budget, preceded by a summary of everything older. The summary
+    is stored per session and only extended with turns that newly fall
+    out of the budget.
+    """
+    turns = groupTurns(getChatHistory(sessionId))
+    summary, summarizedTurns = getSessionSummary(sessionId)
+    # The session may have been cleared and restarted since the summary was written
+    if summarizedTurns > len(turns):
+        summary, summarizedTurns = '', 0
+
+    recent = turns[summarizedTurns:]
+    if sum(countTurnTokens(turn) for turn in recent) > budget:
+        keep = newestTurnsWithin(recent, int(budget * FOLD_TARGET_RATIO))
+        folded = recent[:len(recent) - keep]
+        try:
+            summary = getSummaryChain(SUMMARY_MODEL).invoke({
+                "summary": summary or "(none)",
+                "messages": formatTurns(folded),
+            })
+            summarizedTurns += len(folded)
+            upsertSessionSummary(sessionId, summary, summarizedTurns)
+            recent = recent[len(folded):]
+        except Exception as e:
+            # Still respect the budget; the fold is retried on the next request
+            print(f"Error summarizing history of session {sessionId}: {str(e)}")
+            recent = recent[len(recent) - newestTurnsWithin(recent, budget):]
+
+    history = [message for turn in recent for message in turn]
+    if summary:
+        history.insert(0, {"type": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    return history
+
+async def agetBudgetedHistory(sessionId, budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
+    return await asyncio.to_thread(getBudgetedHistory, sessionId, budget)
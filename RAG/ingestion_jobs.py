@@ -0,0 +1,182 @@
+import hashlib
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from filelock import FileLock, Timeout
+
+from RAG.chroma_utils import hasIndexedChunks, indexDocumentToChroma
+from RAG.db_utils import (claimIngestionJob, deleteDocumentRecord,
+                          getDocumentIdByHash, getOrInsertDocumentRecord,
+                          getUnfinishedIngestionJobs, insertIngestionJob,
+                          setDocumentHash, updateIngestionJob)
+
+SPOOL_DIR = os.getenv('INGESTION_SPOOL_DIR', 'uploads')
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 2))
+
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+# Bounded pool so ingestion never takes more than a few threads away from chat traffic
+executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix='ingestion')
+
+# Jobs are owned by the API process that runs them. Each process holds a lock
+# file for as long as it lives, so when there are several workers, a
+# (re)started one can tell which unfinished jobs have lost their process.
+HOSTNAME = socket.gethostname()
+WORKER_ID = f'{HOSTNAME}-{os.getpid()}'
+workerLock = None
+
+
+# --- Job Ownership ------------------------------------------------------
+
+def getWorkerLockPath(owner: str) -> str:
+    return os.path.join(SPOOL_DIR, f'.worker-{owner}.lock')
+
+
+def holdWorkerLock():
+    global workerLock
+    if workerLock is None:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        workerLock = FileLock(getWorkerLockPath(WORKER_ID))
+        workerLock.acquire()
+
+
+def isOwnerAlive(owner: str | None) -> bool:
+    # Before this process has run anything, its own id can only be left over
+    # from an earlier process with the same pid
+    if owner is None or owner == WORKER_ID:
+        return False
+    lock = FileLock(getWorkerLockPath(owner))
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        return True
+    lock.release()
+    return False
+
+
+# --- Spooling Uploads ---------------------------------------------------
+
+def spoolWithHash(fileobj, buffer) -> str:
+    """
+    Copy an upload into an open file, hashing it on the way. Returns the
+    sha256 hex digest of the contents.
+    """
+    digest = hashlib.sha256()
+    while True:
+        block = fileobj.read(SPOOL_BLOCK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+        buffer.write(block)
+    return digest.hexdigest()
+
+
+def hashFile(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(SPOOL_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Running Ingestion Jobs --------------------------------------------
+
+def runIngestionJob(jobId: str, filename: str, spoolPath: str, fileId: int | None = None,
+                    contentHash: str | None = None):
+    """
+    Index a spooled upload, recording state and progress on the job row.
+    A re-upload of a filename that is already indexed updates that
+    document in place, embedding only its new or changed chunks.
+    """
+    try:
+        if contentHash is None:
+            # Resumed jobs were hashed in a previous run
+            contentHash = hashFile(spoolPath)
+
+        if fileId is None:
+            # An identical upload may have been indexed while this one was queued
+            duplicateOf = getDocumentIdByHash(contentHash)
+            if duplicateOf is not None:
+                updateIngestionJob(jobId, fileId=duplicateOf, status='stored')
+                return
+
+            fileId = getOrInsertDocumentRecord(filename)
+            updateIngestionJob(jobId, fileId=fileId)
+
+        def onProgress(status, chunksEmbedded, totalChunks):
+            updateIngestionJob(jobId, status=status, chunksEmbedded=chunksEmbedded, totalChunks=totalChunks)
+
+        success = indexDocumentToChroma(spoolPath, fileId, source=filename, progressCallback=onProgress)
+
+        if success:
+            setDocumentHash(fileId, contentHash)
+            updateIngestionJob(jobId, status='stored')
+        else:
+            # The chunks added by the failed run are already rolled back; only
+            # drop the record if no previous version of the document remains
+            if not hasIndexedChunks(fileId):
+                deleteDocumentRecord(fileId)
+            updateIngestionJob(jobId, status='failed', error=f"Failed to index {filename}.")
+
+    except Exception as e:
+        print(f"Error running ingestion job {jobId}: {str(e)}")
+        updateIngestionJob(jobId, status='failed', error=str(e))
+
+    finally:
+        if os.path.exists(spoolPath):
+            os.remove(spoolPath)
+
+
+def submitIngestionJob(fileobj, filename: str) -> Tuple[str, int | None]:
+    """
+    Spool an upload to disk and queue it for indexing. Returns the job id
+    and, if identical contents are already indexed, that document's id;
+    such an upload is not parsed or embedded again and its job is
+    recorded as stored right away.
+    """
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    jobId = str(uuid.uuid4())
+    spoolPath = os.path.join(SPOOL_DIR, f'{jobId}{os.path.splitext(filename)[1].lower()}')
+
+    with open(spoolPath, 'wb') as buffer:
+        contentHash = spoolWithHash(fileobj, buffer)
+
+    holdWorkerLock()
+    insertIngestionJob(jobId, filename, spoolPath, owner=WORKER_ID)
+
+    duplicateOf = getDocumentIdByHash(contentHash)
+    if duplicateOf is not None:
+        os.remove(spoolPath)
+        updateIngestionJob(jobId, fileId=duplicateOf, status='stored')
+        return jobId, duplicateOf
+
+    executor.submit(runIngestionJob, jobId, filename, spoolPath, None, contentHash)
+    return jobId, None
+
+
+def resumeIngestionJobs():
+    """
+    Re-queue jobs that were interrupted by a restart, i.e. unfinished jobs
+    on this host whose process is gone. Jobs whose spooled upload no
+    longer exists are marked as failed.
+    """
+    holdWorkerLock()
+    for job in getUnfinishedIngestionJobs():
+        owner = job['owner']
+        # Spooled uploads are local files, so jobs of other hosts are left alone
+        if owner is not None and owner.rsplit('-', 1)[0] != HOSTNAME:
+            continue
+        # Another worker may still be running it, or be resuming it right now
+        if isOwnerAlive(owner) or not claimIngestionJob(job['id'], WORKER_ID, owner):
+            continue
+
+        if not os.path.exists(job['spoolPath']):
+            updateIngestionJob(job['id'], status='failed', error="Upload was lost before it could be indexed.")
+            continue
+
+        # Chunks written before the interruption are reused or removed by
+        # the incremental re-index, so there is nothing to clean up first
+        executor.submit(runIngestionJob, job['id'], job['filename'], job['spoolPath'], job['fileId'])
@@ -1,15 +1,61 @@
-from langchain.chains import (create_history_aware_retriever,
-                              create_retrieval_chain)
-from langchain.chains.combine_documents import create_stuff_documents_chain
+import asyncio
+import os
+import re
+import threading
+from operator import itemgetter
+from typing import Iterable
+
+import numpy as np
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import (RunnableBranch, RunnableGenerator,
+                                      RunnableLambda, RunnablePassthrough)
+
+from RAG.answer_cache import SemanticAnswerCache
+from RAG.bm25_utils import HybridRetriever
+from RAG.chroma_utils import getEmbeddingFunction, getLexicalIndex, getVectorstore
+from RAG.context_utils import packContext
+from RAG.db_utils import getCorpusVersion
+from RAG.metrics_utils import Counter, StageTimingHandler, metrics
 
-from RAG.chroma_utils import vectorstore
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', 12))
+RETRIEVER_FETCH_K = int(os.getenv('RETRIEVER_FETCH_K', 20))
+# A rewritten question at least this similar to the raw one reuses the
+# results retrieved speculatively for the raw question
+SPECULATIVE_REUSE_THRESHOLD = float(os.getenv('SPECULATIVE_REUSE_THRESHOLD', 0.9))
 
-retriever = vectorstore.as_retriever(search_kwargs={"k":2})
 outputParser = StrOutputParser()
 
+# The retriever and the HTTP clients are created on first use, so importing
+# this module opens no store and needs neither the OpenAI client nor a key
+retriever = None
+httpClient = None
+asyncHttpClient = None
+clientsLock = threading.Lock()
+
+# Prebuilt chains, one per model
+ragChains = {}
+summaryChains = {}
+ragChainsLock = threading.Lock()
+
+# Chain steps timed by the stage timing callback, by run name
+CHAIN_STAGES = ('chat_rewrite', 'chat_speculative_retrieve', 'chat_cache_lookup', 'chat_retrieve',
+                'chat_generate', 'history_summarize')
+stageTimingHandler = StageTimingHandler(CHAIN_STAGES)
+
+# skipped: no rewrite needed; reused: rewritten, speculative results used;
+# retrieved: rewritten, retrieved again for the rewritten question
+rewriteOutcomes = Counter('chatdocs_question_rewrite_total', 'How questions were turned into retrieval queries',
+                          ('outcome',))
+metrics.append(rewriteOutcomes)
+
+# Answers are reused for near-identical standalone questions on the same corpus
+answerCache = SemanticAnswerCache(
+    threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 3600)),
+    maxEntries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 5000)),
+)
+
 contextualizeQSystemPrompt = (
     """Given the following conversation history and the latest user question
     which might referenmce the previous conversation context in chat history, 
@@ -30,11 +76,289 @@ QAPrompt = ChatPromptTemplate.from_messages([
     ("human", "{input}"),
 ])
 
+summarizeHistoryPrompt = ChatPromptTemplate.from_messages([
+    ("system", """Maintain a concise running summary of a conversation between a user and an AI assistant.
+    Extend the existing summary with the new messages below. Keep names, identifiers, numbers,
+    decisions and open questions; drop small talk. Reply with the updated summary only."""),
+    ("human", "Existing summary:\n{summary}\n\nNew messages:\n{messages}"),
+])
+
+
+# --- Shared Clients ----------------------------------------------------
+
+def getRetriever() -> HybridRetriever:
+    """
+    Dense and BM25 candidates fused with reciprocal rank fusion. More
+    candidates are fetched than fit in the prompt; packContext picks from them.
+    """
+    global retriever
+    if retriever is None:
+        with clientsLock:
+            if retriever is None:
+                retriever = HybridRetriever(
+                    vectorstore=getVectorstore(),
+                    lexicalIndex=getLexicalIndex(),
+                    k=CONTEXT_CANDIDATES,
+                    fetchK=RETRIEVER_FETCH_K,
+                )
+    return retriever
+
+def getHttpClients():
+    """
+    Shared connection pools so TCP/TLS connections are reused across requests and models
+    """
+    global httpClient, asyncHttpClient
+    if httpClient is None:
+        with clientsLock:
+            if httpClient is None:
+                from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+                asyncHttpClient = DefaultAsyncHttpxClient()
+                httpClient = DefaultHttpxClient()
+    return httpClient, asyncHttpClient
+
+def createChatModel(model: str, **kwargs):
+    # langchain_openai is imported on first use; it pulls in the OpenAI SDK
+    from langchain_openai import ChatOpenAI
+    httpClient, asyncHttpClient = getHttpClients()
+    return ChatOpenAI(model=model, http_client=httpClient, http_async_client=asyncHttpClient, **kwargs)
+
+
+# --- Adaptive Question Rewriting ---------------------------------------
+
+# Words that usually refer back to something earlier in the conversation
+REFERENCE_WORDS = frozenset("""
+    it its itself this that these those they them their theirs he him his she her hers
+    one ones there then former latter above previous earlier same such else
+""".split())
+# Openings of follow-up questions ("and for the second one?", "what about X?")
+FOLLOW_UP_PATTERN = re.compile(
+    r"\s*(and|but|also|so|or|then|what about|how about|why not|what else|anything else|more|another|again)\b",
+    re.IGNORECASE)
+# Questions this short ("why?", "an example?") rarely stand on their own
+MIN_SELF_CONTAINED_WORDS = 4
+QUESTION_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+def needsRewrite(inputs) -> bool:
+    """
+    Cheap check whether the question depends on the chat history. Errs on
+    the side of rewriting: a needless rewrite only costs latency, a missed
+    one retrieves for an unresolved question.
+    """
+    if not inputs.get("chatHistory"):
+        return False
+    question = inputs["input"]
+    words = QUESTION_WORD_PATTERN.findall(question.lower())
+    if len(words) < MIN_SELF_CONTAINED_WORDS or FOLLOW_UP_PATTERN.match(question):
+        return True
+    return any(word in REFERENCE_WORDS for word in words)
+
+def isCloseEnough(inputs) -> bool:
+    """
+    Whether the rewritten question is close enough to the raw one for the
+    speculative results to stand in for it. Both embeddings are already in
+    the embedding cache, from the speculative search and the answer cache lookup.
+    """
+    question, standaloneQuestion = inputs["input"], inputs["standaloneQuestion"]
+    if question.strip().lower() == standaloneQuestion.strip().lower():
+        return True
+    raw = np.asarray(getEmbeddingFunction().embed_query(question))
+    rewritten = inputs.get("questionEmbedding")
+    if rewritten is None:
+        rewritten = getEmbeddingFunction().embed_query(standaloneQuestion)
+    rewritten = np.asarray(rewritten)
+    norms = np.linalg.norm(raw) * np.linalg.norm(rewritten)
+    return bool(norms) and float(raw @ rewritten / norms) >= SPECULATIVE_REUSE_THRESHOLD
+
+def getStandaloneQuestion(llm):
+    """
+    Adds the standalone question to the inputs. The question is only
+    rewritten when needsRewrite says so; while the rewrite runs, retrieval
+    for the raw question runs alongside it and its results are added as
+    speculativeDocs.
+    """
+    def keepQuestion(inputs):
+        rewriteOutcomes.inc(outcome='skipped')
+        return inputs["input"]
+
+    rewriteQuestion = (contextualizeQPrompt | llm | outputParser).with_config(run_name='chat_rewrite')
+    speculativeRetrieve = (itemgetter("input") | getRetriever()).with_config(run_name='chat_speculative_retrieve')
+    return RunnableBranch(
+        (lambda x: not needsRewrite(x), RunnablePassthrough.assign(standaloneQuestion=RunnableLambda(keepQuestion))),
+        RunnablePassthrough.assign(standaloneQuestion=rewriteQuestion, speculativeDocs=speculativeRetrieve),
+    )
+
+def getContextRetriever():
+    """
+    Retrieve and pack the context for the standalone question, reusing the
+    speculative results when the rewrite stayed close to the raw question
+    """
+    def pickSpeculative(inputs):
+        speculativeDocs = inputs.get("speculativeDocs")
+        if speculativeDocs is None:
+            return None
+        if isCloseEnough(inputs):
+            rewriteOutcomes.inc(outcome='reused')
+            return speculativeDocs
+        rewriteOutcomes.inc(outcome='retrieved')
+        return None
+
+    def retrieveContext(inputs, config):
+        documents = pickSpeculative(inputs)
+        if documents is None:
+            documents = getRetriever().invoke(inputs["standaloneQuestion"], config)
+        return packContext(documents)
+
+    async def aretrieveContext(inputs, config):
+        documents = await asyncio.to_thread(pickSpeculative, inputs)
+        if documents is None:
+            documents = await getRetriever().ainvoke(inputs["standaloneQuestion"], config)
+        return packContext(documents)
+
+    return RunnableLambda(retrieveContext, afunc=aretrieveContext).with_config(run_name='chat_retrieve')
+
+
+# --- Answer Cache Steps ------------------------------------------------
+
+# The answer prompt includes the chat history, so only answers to turns
+# without one are shared; with history they could leak between sessions
+def isCacheable(inputs) -> bool:
+    return not inputs.get("chatHistory")
+
+def lookupAnswerCache(standaloneQuestion, chatHistory, model="gpt-4o-mini") -> dict:
+    """
+    Embed the standalone question and look up a cached answer for it. The
+    API calls this before a request is admitted, so a cache hit is replayed
+    without waiting for a slot of the model.
+    """
+    embedding = getEmbeddingFunction().embed_query(standaloneQuestion)
+    corpusVersion = getCorpusVersion()
+    cachedAnswer = None
+    if isCacheable({"chatHistory": chatHistory}):
+        cachedAnswer = answerCache.lookup(embedding, model, corpusVersion)
+    return {"questionEmbedding": embedding, "corpusVersion": corpusVersion, "cachedAnswer": cachedAnswer}
+
+def getAnswerCacheLookup(model):
+    """
+    Look up the answer cache, unless the API already did so for the same question
+    """
+    def lookedUp(inputs):
+        return "cachedAnswer" in inputs and inputs["standaloneQuestion"] == inputs["input"]
+
+    def lookupStep(inputs):
+        return {**inputs, **lookupAnswerCache(inputs["standaloneQuestion"], inputs.get("chatHistory"), model)}
+
+    return RunnableBranch(
+        (lookedUp, RunnablePassthrough()),
+        RunnableLambda(lookupStep).with_config(run_name='chat_cache_lookup'),
+    )
+
+
+def getAnswerCacheWriter(model):
+    """
+    Pass the streamed chunks through unchanged and cache the complete
+    answer once generation has finished, if the turn had no chat history
+    """
+    def collect(state, chunk):
+        for key in ("chatHistory", "questionEmbedding", "corpusVersion", "cachedAnswer"):
+            if key in chunk:
+                state[key] = chunk[key]
+        if chunk.get("answer"):
+            state["answerParts"].append(chunk["answer"])
+
+    def store(state):
+        answer = ''.join(state["answerParts"])
+        if (answer and state.get("cachedAnswer") is None and "questionEmbedding" in state
+                and isCacheable(state)):
+            answerCache.store(state["questionEmbedding"], model, state["corpusVersion"], answer)
+
+    def storeAnswer(chunks):
+        state = {"answerParts": []}
+        for chunk in chunks:
+            collect(state, chunk)
+            yield chunk
+        store(state)
+
+    async def astoreAnswer(chunks):
+        state = {"answerParts": []}
+        async for chunk in chunks:
+            collect(state, chunk)
+            yield chunk
+        store(state)
+
+    return RunnableGenerator(storeAnswer, astoreAnswer)
+
 
 # --- Creating RAG Chain ------------------------------------------------
+def buildRagChain(model="gpt-4o-mini"):
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
+    # stream_usage makes streamed responses report their token counts too
+    llm = createChatModel(model, stream_usage=True)
+
+    questionAnswerChain = create_stuff_documents_chain(llm, QAPrompt).with_config(run_name='chat_generate')
+    retrieveAndAnswer = (
+        RunnablePassthrough.assign(context=getContextRetriever())
+        .assign(answer=questionAnswerChain)
+    )
+    replayCachedAnswer = RunnablePassthrough.assign(answer=itemgetter("cachedAnswer"))
+
+    ragChain = (
+        getStandaloneQuestion(llm)
+        | getAnswerCacheLookup(model)
+        | RunnableBranch(
+            (lambda x: x["cachedAnswer"] is not None, replayCachedAnswer),
+            retrieveAndAnswer,
+        )
+        | getAnswerCacheWriter(model)
+    )
+    return ragChain.with_config(callbacks=[stageTimingHandler])
+
+
+# --- Chain Registry ----------------------------------------------------
+
 def getRagChain(model="gpt-4o-mini"):
-    llm = ChatOpenAI(model=model)
-    historyAwareRetriever = create_history_aware_retriever(llm, retriever, contextualizeQPrompt)
-    questionAnswerChain = create_stuff_documents_chain(llm, QAPrompt)
-    ragChain = create_retrieval_chain(historyAwareRetriever, questionAnswerChain)    
+    """
+    Get the prebuilt chain for a model, building it on first use
+    """
+    ragChain = ragChains.get(model)
+    if ragChain is None:
+        with ragChainsLock:
+            ragChain = ragChains.get(model)
+            if ragChain is None:
+                ragChain = ragChains[model] = buildRagChain(model)
     return ragChain
+
+def getSummaryChain(model="gpt-4o-mini"):
+    """
+    Get the chain used to fold old chat turns into the session summary
+    """
+    summaryChain = summaryChains.get(model)
+    if summaryChain is None:
+        with ragChainsLock:
+            summaryChain = summaryChains.get(model)
+            if summaryChain is None:
+                llm = createChatModel(model)
+                summaryChain = summaryChains[model] = (summarizeHistoryPrompt | llm | outputParser).with_config(
+                    run_name='history_summarize', callbacks=[stageTimingHandler])
+    return summaryChain
+
+def warmRagChains(models: Iterable[str]):
+    """
+    Build the chains for the given models ahead of the first request
+    """
+    for model in models:
+        getRagChain(model)
+
+def resetRagChains():
+    """
+    Drop all prebuilt chains, e.g. after the API key changes. The chains
+    are rebuilt with the new key on next use.
+    """
+    with ragChainsLock:
+        ragChains.clear()
+        summaryChains.clear()
+
+async def closeHttpClients():
+    if httpClient is not None:
+        httpClient.close()
+        await asyncHttpClient.aclose()
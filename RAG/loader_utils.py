@@ -0,0 +1,219 @@
+import codecs
+import os
+from html.parser import HTMLParser
+from typing import Iterator, List
+
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Kept free of vector store / embedding setup so that parser processes can
+# import it without opening Chroma or creating API clients.
+
+# Initialize text splitter
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# add_start_index records where each split starts, so overlapping neighbours can be stitched exactly
+textSplitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len,
+                                              add_start_index=True)
+
+# Native loaders emit sections of roughly this many characters
+SECTION_SIZE = 64_000
+READ_BLOCK_SIZE = 64 * 1024
+
+# Opt in to Unstructured for HTML that the native extractor can't handle
+USE_UNSTRUCTURED_HTML = os.getenv('USE_UNSTRUCTURED_HTML', '').lower() in ('1', 'true', 'yes')
+
+
+# --- Native Text & HTML Loaders ----------------------------------------
+
+def detectEncoding(filepath: str) -> str:
+    """
+    Detect a file's encoding from its BOM or a sample of its bytes
+    """
+    with open(filepath, 'rb') as file:
+        sample = file.read(READ_BLOCK_SIZE)
+
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'),
+                          (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if sample.startswith(bom):
+            return encoding
+
+    try:
+        # Incremental decode so a multi-byte character cut off at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return 'cp1252'
+    matches = from_bytes(sample)
+    best = matches.best()
+    if best is None:
+        return 'cp1252'
+    # Short or plain samples fit many single-byte code pages equally well
+    # (cp1252's "naïve" reads as "naďve" in cp1250); prefer the most common
+    # one, cp1252, unless another fits the sample better
+    if any(match.encoding == 'cp1252' and match.chaos <= best.chaos for match in matches):
+        return 'cp1252'
+    return best.encoding
+
+
+def iterTextBlocks(filepath: str) -> Iterator[str]:
+    """
+    Stream a text file as decoded blocks
+    """
+    with open(filepath, encoding=detectEncoding(filepath), errors='replace', newline='') as file:
+        while block := file.read(READ_BLOCK_SIZE):
+            yield block
+
+
+def iterSections(blocks: Iterator[str]) -> Iterator[str]:
+    """
+    Regroup a stream of text blocks into sections of about SECTION_SIZE
+    characters, breaking at line boundaries where possible
+    """
+    buffer = ''
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= SECTION_SIZE:
+            cut = buffer.rfind('\n', 0, SECTION_SIZE)
+            cut = cut + 1 if cut > 0 else SECTION_SIZE
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer.strip():
+        yield buffer
+
+
+class TextFileLoader(BaseLoader):
+    """
+    Plain-text loader that streams the file with encoding detection
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+
+    def lazy_load(self) -> Iterator[Document]:
+        for section in iterSections(iterTextBlocks(self.filepath)):
+            yield Document(page_content=section, metadata={'source': self.filepath})
+
+
+class HTMLTextExtractor(HTMLParser):
+    """
+    Collects the visible text of an HTML document
+    """
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg'}
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'table', 'section', 'article', 'header', 'footer',
+                  'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'ul', 'ol', 'hr', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipDepth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skipDepth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skipDepth = max(0, self.skipDepth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skipDepth:
+            self.parts.append(data)
+
+    def drain(self, final: bool = False) -> str:
+        """
+        Return the completed lines collected so far. A trailing partial
+        line is kept back until more input arrives, unless `final` is set.
+        """
+        text = ''.join(self.parts)
+        cut = len(text) if final else text.rfind('\n') + 1
+        text, self.parts = text[:cut], [text[cut:]]
+        # Collapse the whitespace runs left behind by markup
+        lines = (' '.join(line.split()) for line in text.splitlines())
+        return ''.join(f'{line}\n' for line in lines if line)
+
+
+class HTMLTextLoader(BaseLoader):
+    """
+    HTML loader built on the standard library's HTMLParser
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+
+    def iterText(self) -> Iterator[str]:
+        extractor = HTMLTextExtractor()
+        for block in iterTextBlocks(self.filepath):
+            extractor.feed(block)
+            yield extractor.drain()
+        extractor.close()
+        yield extractor.drain(final=True)
+
+    def lazy_load(self) -> Iterator[Document]:
+        for section in iterSections(self.iterText()):
+            yield Document(page_content=section, metadata={'source': self.filepath})
+
+
+# --- Loading & Splitting Documents -------------------------------------
+
+def getLoader(filepath: str) -> BaseLoader:
+    # Heavy loaders are imported only when a file of their type is loaded
+    if filepath.endswith('.pdf'):
+        from langchain_community.document_loaders import PyPDFLoader
+        return PyPDFLoader(filepath)
+    elif filepath.endswith('.docx'):
+        from langchain_community.document_loaders import Docx2txtLoader
+        return Docx2txtLoader(filepath)
+    elif filepath.endswith('.html'):
+        if USE_UNSTRUCTURED_HTML:
+            from langchain_community.document_loaders import UnstructuredHTMLLoader
+            return UnstructuredHTMLLoader(filepath)
+        return HTMLTextLoader(filepath)
+    elif filepath.endswith('.txt'):
+        return TextFileLoader(filepath)
+    else:
+        raise ValueError(f"Unsupported file type: {filepath}")
+
+
+def iterDocumentSplits(filepath: str) -> Iterator[Document]:
+    """
+    Lazily load a document page by page (or section by section) and split
+    each one as it arrives, so the whole file is never held in memory.
+    Each split's startIndex is its character offset in the whole file,
+    with the pages (or sections) laid end to end.
+    """
+    offset = 0
+    for document in getLoader(filepath).lazy_load():
+        for split in textSplitter.split_documents([document]):
+            split.metadata['startIndex'] = offset + split.metadata.pop('start_index')
+            yield split
+        offset += len(document.page_content)
+
+
+def iterSplitBatches(filepath: str, batchSize: int) -> Iterator[List[Document]]:
+    """
+    Group the splits of a document into fixed-size batches
+    """
+    batch = []
+    for split in iterDocumentSplits(filepath):
+        batch.append(split)
+        if len(batch) >= batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def loadAndSplitDocument(filepath: str) -> List[Document]:
+    return list(iterDocumentSplits(filepath))
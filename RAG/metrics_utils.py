@@ -0,0 +1,215 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, List, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Seconds; covers everything from a cache lookup to a slow generation
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (stage, seconds) pairs recorded while handling the current request, for the Server-Timing header
+requestTimings: ContextVar[List[Tuple[str, float]] | None] = ContextVar('requestTimings', default=None)
+
+
+# --- Metric Types ------------------------------------------------------
+
+def formatLabels(labelNames, labelValues) -> str:
+    if not labelNames:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(labelNames, labelValues))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """
+    Monotonic counter, one series per combination of label values
+    """
+
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labelNames = labelNames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelNames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{formatLabels(self.labelNames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus format. Observing is a
+    bisect and three additions under a lock.
+    """
+
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelNames = labelNames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelNames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucketCount in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucketCount
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    labels = formatLabels(self.labelNames + ('le',), key + (le,))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = formatLabels(self.labelNames, key)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+# --- Registry ----------------------------------------------------------
+
+stageSeconds = Histogram('chatdocs_stage_seconds', 'Latency of chat and ingestion pipeline stages', ('stage',))
+requestSeconds = Histogram('chatdocs_http_request_seconds', 'Time until the response headers are sent',
+                           ('method', 'path', 'status'))
+tokensTotal = Counter('chatdocs_tokens_total', 'Tokens sent to and received from models', ('kind', 'model'))
+
+metrics = [stageSeconds, requestSeconds, tokensTotal]
+
+def renderMetrics() -> str:
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Timing Stages -----------------------------------------------------
+
+def recordStage(stage: str, seconds: float):
+    stageSeconds.observe(seconds, stage=stage)
+    timings = requestTimings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+@contextmanager
+def timedStage(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recordStage(stage, time.perf_counter() - start)
+
+def timedIterator(iterable: Iterable, stage: str) -> Iterator:
+    """
+    Yield from `iterable`, timing how long each item takes to produce
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        recordStage(stage, time.perf_counter() - start)
+        yield item
+
+def startRequestTimings() -> List[Tuple[str, float]]:
+    timings = []
+    requestTimings.set(timings)
+    return timings
+
+def formatServerTiming(timings: List[Tuple[str, float]]) -> str:
+    # Server-Timing durations are in milliseconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings)
+
+
+# --- LangChain Callbacks -----------------------------------------------
+
+class StageTimingHandler(BaseCallbackHandler):
+    """
+    Times named chain steps (see CHAIN_STAGES) and model calls, and counts
+    the tokens models report. Runs inline on the caller's thread or event
+    loop, so it adds no scheduling overhead.
+    """
+
+    run_inline = True
+
+    def __init__(self, stages: Iterable[str]):
+        self.stages = set(stages)
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        stage = kwargs.get('name')
+        if stage in self.stages:
+            with self._lock:
+                self._runs[run_id] = (stage, time.perf_counter())
+
+    def _finishChain(self, run_id):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            recordStage(run[0], time.perf_counter() - run[1])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finishChain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finishChain(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = (metadata or {}).get('ls_model_name', 'unknown')
+        with self._lock:
+            self._runs[run_id] = (model, time.perf_counter(), False)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[2]:
+                return
+            self._runs[run_id] = (run[0], run[1], True)
+        recordStage('llm_first_token', time.perf_counter() - run[1])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        recordStage('llm_call', time.perf_counter() - run[1])
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    tokensTotal.inc(usage.get('input_tokens', 0), kind='prompt', model=run[0])
+                    tokensTotal.inc(usage.get('output_tokens', 0), kind='completion', model=run[0])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._runs.pop(run_id, None)
@@ -20,6 +20,18 @@ class DocumentInfo(BaseModel):
     id: int
     filename: str
     uploadTimestamp: datetime
+    version: int = 1
 
 class DeleteFileRequest(BaseModel):
-    fileId: int
\ No newline at end of file
+    fileId: int
+
+class IngestionJobInfo(BaseModel):
+    id: str
+    filename: str
+    fileId: int | None = None
+    status: str
+    chunksEmbedded: int = 0
+    totalChunks: int | None = None
+    error: str | None = None
+    createdAt: datetime
+    updatedAt: datetime
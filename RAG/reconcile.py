@@ -0,0 +1,111 @@
+"""
+Consistency check between the document records, the chunk registry, the
+Chroma collection and the lexical index.
+
+    python -m RAG.reconcile            # report only
+    python -m RAG.reconcile --repair   # also fix what was found
+
+Run it while the API is stopped, or at least while nothing is being uploaded.
+"""
+import argparse
+
+from RAG.chroma_utils import (deleteChunksById, fetchChunks, getLexicalIndex,
+                              getVectorstore)
+from RAG.db_utils import (bumpCorpusVersion, deleteChunkRecords,
+                          deleteDocumentRecord, getAllChunkRecords,
+                          getAllDocumentIds, getUnfinishedIngestionJobs,
+                          initDatabase, registerChunks)
+
+
+def scanCollection(pageSize: int):
+    """
+    Yield (chunkId, metadata) for every vector in the collection
+    """
+    offset = 0
+    while True:
+        page = getVectorstore()._collection.get(limit=pageSize, offset=offset, include=['metadatas'])
+        if not page['ids']:
+            return
+        for chunkId, metadata in zip(page['ids'], page['metadatas']):
+            yield chunkId, metadata or {}
+        offset += len(page['ids'])
+
+
+def reconcileStores(repair: bool = False, pageSize: int = 1000) -> dict:
+    """
+    Find vectors without a document record (orphaned vectors), vectors
+    missing from the registry, registry rows without a vector, documents
+    without any chunks and lexical entries that differ from Chroma.
+    With `repair`, orphaned vectors and dangling rows are deleted, missing
+    rows are registered, empty documents are deleted and the lexical index
+    is brought in line with Chroma. Returns the counts of each.
+    """
+    initDatabase()
+    documentIds = getAllDocumentIds()
+    registry = getAllChunkRecords()
+    # Documents still being ingested legitimately have no chunks yet
+    busyIds = {job['fileId'] for job in getUnfinishedIngestionJobs()}
+
+    orphanedVectors = []
+    unregistered = []
+    indexed = {}
+    for chunkId, metadata in scanCollection(pageSize):
+        fileId = metadata.get('fileId')
+        if fileId not in documentIds and fileId not in busyIds:
+            orphanedVectors.append(chunkId)
+            continue
+        indexed[chunkId] = fileId
+        if chunkId not in registry:
+            unregistered.append((chunkId, fileId, metadata.get('chunkHash'), metadata.get('chunkIndex')))
+
+    orphanedIds = set(orphanedVectors)
+    danglingRecords = [chunkId for chunkId in registry if chunkId not in indexed and chunkId not in orphanedIds]
+    emptyDocuments = sorted(documentIds - set(indexed.values()) - busyIds)
+
+    lexicalIndex = getLexicalIndex()
+    lexicalKeys = lexicalIndex.keys()
+    staleLexical = [key for key in lexicalKeys if key not in indexed]
+    missingLexical = [chunkId for chunkId in indexed if chunkId not in lexicalKeys]
+
+    report = {
+        "orphanedVectors": len(orphanedVectors),
+        "unregisteredVectors": len(unregistered),
+        "danglingRecords": len(danglingRecords),
+        "emptyDocuments": len(emptyDocuments),
+        "staleLexicalEntries": len(staleLexical),
+        "missingLexicalEntries": len(missingLexical),
+    }
+    if not repair or not any(report.values()):
+        return report
+
+    deleteChunksById(orphanedVectors)
+    registerChunks(unregistered)
+    deleteChunkRecords(danglingRecords)
+    for fileId in emptyDocuments:
+        deleteDocumentRecord(fileId)
+
+    missingChunks = list(fetchChunks(missingLexical))
+    with lexicalIndex.transaction():
+        lexicalIndex.removeKeys(staleLexical)
+        lexicalIndex.add(missingChunks)
+    bumpCorpusVersion()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repair', action='store_true', help="Fix the inconsistencies that are found")
+    parser.add_argument('--page-size', type=int, default=1000, help="Vectors read from Chroma per call")
+    args = parser.parse_args()
+
+    report = reconcileStores(repair=args.repair, pageSize=args.page_size)
+    for name, count in report.items():
+        print(f'{name}: {count}')
+    if any(report.values()):
+        print('Repaired.' if args.repair else 'Run with --repair to fix.')
+    else:
+        print('Stores are consistent.')
+
+
+if __name__ == '__main__':
+    main()
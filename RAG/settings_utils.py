@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+from RAG.chroma_utils import reopenCollection, resetEmbeddingClient
+from RAG.db_utils import getSettings, setSetting
+from RAG.langchain_utils import resetRagChains
+
+# Settings live in the database, so every API worker sees a change made
+# through any of them; each worker checks for changes at most this often
+SETTINGS_REFRESH_INTERVAL = float(os.getenv('SETTINGS_REFRESH_INTERVAL', 1.0))
+
+# Values this worker has applied, by setting name
+appliedSettings = {}
+lastRefresh = 0.0
+settingsLock = threading.Lock()
+
+
+# --- Applying Settings -------------------------------------------------
+
+def applyApiKey(apiKey: str):
+    os.environ['OPENAI_API_KEY'] = apiKey
+    # Clients capture the key when they are built, so rebuild them
+    resetEmbeddingClient()
+    resetRagChains()
+
+# Setting name -> function that applies a new value in this worker
+settingHandlers = {
+    'openai_api_key': applyApiKey,
+    'collection_generation': lambda _: reopenCollection(),
+}
+# Setting name -> functions called with the value once it has been applied
+settingListeners = {name: [] for name in settingHandlers}
+
+def onSettingApplied(name: str, listener):
+    settingListeners[name].append(listener)
+
+
+# --- Shared Settings ---------------------------------------------------
+
+def settingsDue() -> bool:
+    return time.monotonic() - lastRefresh >= SETTINGS_REFRESH_INTERVAL
+
+def refreshSharedSettings(force: bool = False) -> bool:
+    """
+    Apply the settings changed since this worker last checked. Returns
+    whether anything changed.
+    """
+    global lastRefresh
+    if not force and not settingsDue():
+        return False
+
+    with settingsLock:
+        lastRefresh = time.monotonic()
+        settings = getSettings()
+        changed = False
+        for name, handler in settingHandlers.items():
+            value = settings.get(name)
+            if value is not None and appliedSettings.get(name) != value:
+                handler(value)
+                appliedSettings[name] = value
+                for listener in settingListeners[name]:
+                    listener(value)
+                changed = True
+    return changed
+
+def setSharedSetting(name: str, value: str):
+    """
+    Store a setting for all workers and apply it in this one right away
+    """
+    setSetting(name, value)
+    refreshSharedSettings(force=True)
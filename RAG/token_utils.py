@@ -0,0 +1,19 @@
+from functools import lru_cache
+
+
+# --- Token Counting ----------------------------------------------------
+
+@lru_cache(maxsize=1)
+def getTokenizer():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding('o200k_base')
+    except Exception:
+        # tiktoken missing or its encoding files unavailable offline
+        return None
+
+def countTokens(text: str) -> int:
+    tokenizer = getTokenizer()
+    if tokenizer is None:
+        return len(text) // 4 + 1
+    return len(tokenizer.encode(text, disallowed_special=()))
@@ -1,39 +1,140 @@
 import asyncio
+import json
 import logging
 import os
-import shutil
-import uuid
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
-from RAG.chroma_utils import deleteDocumentFromChroma, indexDocumentToChroma
-from RAG.db_utils import (deleteDocumentRecord, getAllDocuments,
-                          getChatHistory, insertApplicationLogs,
-                          insertDocumentRecord)
-from RAG.langchain_utils import getRagChain
-from RAG.pydantic_models import (DeleteFileRequest, DocumentInfo, QueryInput)
+from RAG.admission_utils import AdmissionRejected, SingleFlight
+from RAG.chroma_utils import (deleteDocumentFromChroma, getEmbeddingFunction,
+                              getVectorstore, hasIndexedChunks,
+                              indexDocumentsToChroma, shutdownParsePool,
+                              syncChunkRegistry, syncLexicalIndex)
+from RAG.db_utils import (ainsertApplicationLogs,
+                          closeDbConnections, deleteDocumentRecord,
+                          getAllDocuments, getDocumentIdByFilename,
+                          getDocumentIdByHash, getIngestionJob,
+                          getOrInsertDocumentRecord, initDatabase, logSink,
+                          setDocumentHash)
+from RAG.embedding_utils import EMBEDDING_BACKEND
+from RAG.history_utils import agetBudgetedHistory
+from RAG.ingestion_jobs import (executor, resumeIngestionJobs,
+                                spoolWithHash, submitIngestionJob)
+from RAG.langchain_utils import (answerCache, closeHttpClients, getRagChain,
+                                 isCacheable, lookupAnswerCache, warmRagChains)
+from RAG.metrics_utils import (formatServerTiming, recordStage, renderMetrics,
+                               requestSeconds, startRequestTimings, timedStage)
+from RAG.pydantic_models import (DeleteFileRequest, DocumentInfo,
+                                 IngestionJobInfo, ModelName, QueryInput)
+from RAG.settings_utils import (onSettingApplied, refreshSharedSettings,
+                                setSharedSetting, settingsDue)
 
 load_dotenv()
 
-OPENAI_API_KEY = None
-
 # Initialize logging
 logging.basicConfig(filename='logs/app.log', level=logging.DEBUG)
 
+# --- Startup & Readiness ----------------------------------------------
+
+# Warm-up steps, run in order in the background after startup. The server
+# accepts requests right away; anything not yet warm is created on first use.
+# Optional steps may fail without making the server unready. Steps that need
+# an OpenAI key wait for one instead of failing, so the key can still be set
+# through the API; they are run again once it is.
+readiness = {"ready": False, "steps": {}}
+warmUpLock = threading.Lock()
+
+def hasApiKey() -> bool:
+    return bool(os.getenv('OPENAI_API_KEY'))
+
+def warmUpSteps():
+    # (name, step, optional, needs an API key)
+    embeddingNeedsKey = EMBEDDING_BACKEND == 'openai'
+    return [
+        ("database", initDatabase, False, False),
+        # The API key and other settings stored by any worker
+        ("settings", lambda: refreshSharedSettings(force=True), False, False),
+        ("vectorstore", getVectorstore, False, embeddingNeedsKey),
+        # Builds the lexical index from Chroma if it is missing
+        ("lexicalIndex", syncLexicalIndex, False, embeddingNeedsKey),
+        # Registers chunks indexed before the chunk registry existed
+        ("chunkRegistry", syncChunkRegistry, False, embeddingNeedsKey),
+        ("chains", lambda: warmRagChains(model.value for model in ModelName), True, True),
+    ]
+
+def warmUp():
+    with warmUpLock:
+        ready = True
+        for name, step, optional, needsKey in warmUpSteps():
+            if readiness["steps"].get(name) == "ready":
+                continue
+            if needsKey and not hasApiKey():
+                readiness["steps"][name] = "waiting for API key"
+                continue
+            try:
+                step()
+                readiness["steps"][name] = "ready"
+            except Exception as e:
+                logging.warning(f"Warm-up step {name} failed: {str(e)}")
+                readiness["steps"][name] = f"failed: {str(e)}"
+                ready = ready and optional
+        readiness["ready"] = ready
+
+def warmUpWithApiKey(apiKey: str):
+    """
+    Run the steps that waited for (or failed without) an API key again once
+    this worker has one. Called with the settings lock held, so in a thread
+    of its own.
+    """
+    if any(status != "ready" for status in readiness["steps"].values()):
+        threading.Thread(target=warmUp, name='warm-up', daemon=True).start()
+
+onSettingApplied('openai_api_key', warmUpWithApiKey)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up ingestion jobs that were interrupted by the last shutdown. This
+    # only queues them, and must happen before new uploads are accepted.
+    resumeIngestionJobs()
+    warmUpTask = asyncio.create_task(asyncio.to_thread(warmUp))
+    yield
+    # Don't tear down what warm-up may still be using
+    await warmUpTask
+    await asyncio.to_thread(warmUpLock.acquire)
+    executor.shutdown(wait=False, cancel_futures=True)
+    shutdownParsePool()
+    await closeHttpClients()
+    logSink.close()
+    closeDbConnections()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# In-flight chat generations, shared by identical concurrent requests
+chatFlights = SingleFlight()
 
 # Add new endpoint to set API key
 @app.post("/setApiKey")
 async def set_api_key(api_key: str):
-    global OPENAI_API_KEY
-    OPENAI_API_KEY = api_key
-    os.environ['OPENAI_API_KEY'] = api_key
+    # Stored in the database so every worker picks it up, and applied here right away
+    await asyncio.to_thread(setSharedSetting, 'openai_api_key', api_key)
+    # Building the chains imports and constructs clients, so keep it off the event loop
+    await asyncio.to_thread(warmRagChains, [model.value for model in ModelName])
     return {"message": "API key set successfully"}
 
+# Readiness Endpoint
+@app.get("/ready")
+def ready():
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -43,6 +144,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Shared Settings --------------------------------------------------
+
+@app.middleware("http")
+async def sharedSettings(request: Request, call_next):
+    """
+    Apply settings that another worker has changed, e.g. a new API key,
+    before handling the request. Checked at most every few seconds.
+    """
+    if settingsDue():
+        await asyncio.to_thread(refreshSharedSettings)
+    return await call_next(request)
+
+# --- Instrumentation --------------------------------------------------
+
+@app.middleware("http")
+async def serverTiming(request: Request, call_next):
+    """
+    Time every request and report the stages that ran before the response
+    started in a Server-Timing header. Stages of a streamed /chat answer
+    finish after the headers are sent; they are only in /metrics.
+    """
+    timings = startRequestTimings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    # Label by route template, not raw path, to keep the number of series bounded
+    route = request.scope.get('route')
+    requestSeconds.observe(elapsed, method=request.method, path=getattr(route, 'path', 'unmatched'),
+                           status=response.status_code)
+    response.headers['Server-Timing'] = formatServerTiming(timings + [('total', elapsed)])
+    return response
+
+# Metrics Endpoint
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(renderMetrics(), media_type='text/plain; version=0.0.4')
+
+# --- Server-Sent Events -----------------------------------------------
+
+def formatSSE(data, event=None):
+    """
+    Frame a payload as a Server-Sent Event. The data is JSON-encoded so that
+    newlines inside model tokens never break the event framing.
+    """
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
 # Chat Endpoint
 @app.post("/chat")
 async def chat(queryInput: QueryInput):
@@ -53,62 +204,176 @@ async def chat(queryInput: QueryInput):
         
         logging.info(f'Session ID: {sessionId}, User Query: {queryInput.question}, Model: {model}')
         
-        chatHistory = getChatHistory(sessionId)
+        requestStart = time.perf_counter()
+        with timedStage('chat_history'):
+            chatHistory = await agetBudgetedHistory(sessionId)
         ragChain = getRagChain(model)
-        
+        chainInput = {"input": queryInput.question, "chatHistory": chatHistory}
+
+        # Look up the answer cache before admission, so a cached answer is
+        # replayed without a slot of the model; on a miss the chain reuses the lookup
+        if isCacheable(chainInput):
+            with timedStage('chat_cache_lookup'):
+                chainInput.update(await asyncio.to_thread(lookupAnswerCache, queryInput.question, chatHistory, model))
+
+        async def produceAnswer():
+            # Forward model tokens as soon as the chain produces them
+            async for chunk in ragChain.astream(chainInput):
+                token = chunk.get('answer')
+                if token:
+                    yield token
+
+        async def replayAnswer():
+            yield chainInput["cachedAnswer"]
+
+        if chainInput.get("cachedAnswer") is not None:
+            tokens, leaveFlight = replayAnswer(), None
+        else:
+            # Identical concurrent requests share one generation, also while it
+            # waits in the queue of the model's pool; only the generation takes a slot
+            flightKey = (model, queryInput.question.strip(), json.dumps(chatHistory, sort_keys=True))
+            subscription = await chatFlights.join(flightKey, model, produceAnswer)
+            tokens, leaveFlight = subscription, BackgroundTask(subscription.leave)
+
         async def generate():
-            response = ragChain.invoke({
-                "input": queryInput.question,
-                "chatHistory": chatHistory
-            })
-            
-            answer = response.get('answer', '')
-            if not answer:
-                raise ValueError("No answer received from the model")
-            
-            # Stream the response character by character
-            for char in answer:
-                yield char
-                await asyncio.sleep(0.005)  # Small delay for natural feel
-            
+            answerParts = []
+            try:
+                # If the client disconnects, this generator is cancelled and
+                # leaves the flight; the generation stops once no one is left
+                async for token in tokens:
+                    if not answerParts:
+                        recordStage('chat_first_token', time.perf_counter() - requestStart)
+                    answerParts.append(token)
+                    yield formatSSE(token)
+
+                answer = ''.join(answerParts)
+                if not answer:
+                    raise ValueError("No answer received from the model")
+
+            except Exception as e:
+                logging.error(f"Chat error for session {sessionId}: {str(e)}")
+                yield formatSSE(str(e), event='error')
+                return
+
+            yield formatSSE('', event='done')
+
+            recordStage('chat_total', time.perf_counter() - requestStart)
+
             # Save the complete response to database after streaming
-            insertApplicationLogs(sessionId, queryInput.question, answer, model)
+            with timedStage('chat_log_insert'):
+                await ainsertApplicationLogs(sessionId, queryInput.question, answer, model)
             logging.info(f"Session ID: {sessionId}, Response: {answer}")
         
-        return StreamingResponse(generate(), media_type='text/event-stream')
-    
+        # Leaves the flight even if the stream never started
+        return StreamingResponse(generate(), media_type='text/event-stream', background=leaveFlight)
+
+    except AdmissionRejected as e:
+        logging.warning(f"Chat request for session {sessionId} rejected: {e.detail}")
+        raise HTTPException(status_code=e.statusCode, detail=e.detail, headers={"Retry-After": str(e.retryAfter)})
+
     except Exception as e:
         logging.error(f"Chat error for session {sessionId}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.txt', '.html']
+
 # Upload Document Endpoint
-@app.post("/uploadDoc")
+@app.post("/uploadDoc", status_code=202)
 def uploadAndIndexDocument(file: UploadFile = File(...)):
-    allowedExtensions = ['.pdf', '֫.docx', '.txt', '.html']
     fileExtention = os.path.splitext(file.filename)[1].lower()
     
-    if fileExtention not in allowedExtensions:
-        raise HTTPException(status_code=400, detail="Unsupported file type. Allowed types are: {', '.join(allowedExtensions)}")
-    
-    tempFilePath = f'temp_{file.filename}'
+    if fileExtention not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(ALLOWED_EXTENSIONS)}")
     
+    # Indexing happens in the background; poll /jobs/{jobId} for progress
+    jobId, duplicateOf = submitIngestionJob(file.file, file.filename)
+    if duplicateOf is not None:
+        return {"message": f"File {file.filename} is already indexed.", "jobId": jobId,
+                "fileId": duplicateOf, "duplicate": True}
+    return {"message": f"File {file.filename} queued for indexing.", "jobId": jobId}
+
+# Batch Upload Endpoint
+@app.post("/uploadDocs")
+def uploadAndIndexDocuments(files: list[UploadFile] = File(...)):
+    results = []
+    spooled = []
+    # Content hash -> result of the first upload with those bytes in this request
+    hashedResults = {}
+    repeats = []
+    seenFilenames = set()
+
     try:
-        # Save the uploaded file to a temp file
-        with open(tempFilePath, 'wb') as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        fileId = insertDocumentRecord(file.filename)
-        success = indexDocumentToChroma(tempFilePath, fileId)
-        
-        if success:
-            return {"message": f"File {file.filename} successfully uploaded and indexed.", "fileId": fileId}
-        else:
-            deleteDocumentRecord(fileId)
-            raise HTTPException(status_code=500, detail=f"Failed to index {file.filename}.")
-        
+        for file in files:
+            fileExtention = os.path.splitext(file.filename)[1].lower()
+            if fileExtention not in ALLOWED_EXTENSIONS:
+                results.append({"filename": file.filename, "fileId": None, "chunks": 0, "success": False,
+                                "error": f"Unsupported file type. Allowed types are: {', '.join(ALLOWED_EXTENSIONS)}"})
+                continue
+
+            if file.filename in seenFilenames:
+                results.append({"filename": file.filename, "fileId": None, "chunks": 0, "success": False,
+                                "error": "The same filename appears more than once in this upload."})
+                continue
+            seenFilenames.add(file.filename)
+
+            # A re-upload of an indexed filename updates that document incrementally
+            fileId = getDocumentIdByFilename(file.filename)
+
+            # Unique temp file per upload so same-named files never collide
+            with tempfile.NamedTemporaryFile(suffix=fileExtention, delete=False) as buffer:
+                contentHash = spoolWithHash(file.file, buffer)
+
+            # Identical bytes are never parsed or embedded twice
+            duplicateOf = getDocumentIdByHash(contentHash)
+            if duplicateOf is not None or contentHash in hashedResults:
+                os.remove(buffer.name)
+                result = {"filename": file.filename, "fileId": duplicateOf, "chunks": 0, "success": True,
+                          "error": None, "duplicate": True}
+                if duplicateOf is None:
+                    repeats.append((result, hashedResults[contentHash]))
+                results.append(result)
+                continue
+
+            if fileId is None:
+                fileId = getOrInsertDocumentRecord(file.filename)
+            spooled.append((buffer.name, fileId, file.filename))
+            result = {"filename": file.filename, "fileId": fileId, "contentHash": contentHash}
+            hashedResults[contentHash] = result
+            results.append(result)
+
+        indexResults = indexDocumentsToChroma(spooled)
+
+        for result in results:
+            if result["fileId"] is None or result.get("duplicate"):
+                continue
+            result.update(indexResults[result["fileId"]])
+            contentHash = result.pop("contentHash")
+            if result["success"]:
+                setDocumentHash(result["fileId"], contentHash)
+            else:
+                # Keep the record if a previous version of the document is still indexed
+                if not hasIndexedChunks(result["fileId"]):
+                    deleteDocumentRecord(result["fileId"])
+                result["fileId"] = None
+
+        # Repeats within this request share the outcome of the first copy
+        for result, original in repeats:
+            result.update(fileId=original["fileId"], success=original["success"], error=original["error"])
+
+        return {"results": results}
+
     finally:
-        if os.path.exists(tempFilePath):
-            os.remove(tempFilePath)        
+        for tempFilePath, _, _ in spooled:
+            if os.path.exists(tempFilePath):
+                os.remove(tempFilePath)
+
+# Ingestion Job Status Endpoint
+@app.get('/jobs/{jobId}', response_model=IngestionJobInfo)
+def getJobStatus(jobId: str):
+    job = getIngestionJob(jobId)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {jobId} not found")
+    return job
         
 # List Documents Endpoint
 @app.get('/listDocs', response_model=list[DocumentInfo])
@@ -159,3 +424,10 @@ def clearSession(session_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Cache Statistics Endpoint
+@app.get('/cacheStats')
+def cacheStats():
+    return {
+        "embeddingCache": getEmbeddingFunction().stats(),
+        "answerCache": answerCache.stats(),
+    }
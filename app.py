@@ -1,19 +1,13 @@
 # app.py
+import json
 import os
-import subprocess
-import threading
+import time
 import uuid
 from datetime import datetime
 
 import requests
 import streamlit as st
-
-# Start the FastAPI server in a separate thread
-def start_fastapi():
-    subprocess.run(['uvicorn', 'api:app', '--reload', '--host', '0.0.0.0', '--port', '8000'])
-
-fastapi_thread = threading.Thread(target=start_fastapi)
-fastapi_thread.start()
+from requests.adapters import HTTPAdapter
 
 # Configure page settings
 st.set_page_config(
@@ -23,9 +17,25 @@ st.set_page_config(
 )
 
 # Constants
-API_BASE_URL = "http://localhost:8000"
+# The API is started separately (see run.sh), locally or on another host
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000").rstrip("/")
 ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.txt']
 
+# Streamed answers are re-rendered at most every RENDER_INTERVAL seconds,
+# or sooner once RENDER_MIN_CHARS new characters have arrived
+RENDER_INTERVAL = 0.1
+RENDER_MIN_CHARS = 200
+
+def get_http_session():
+    """Pooled HTTP session per browser session, kept across reruns; requests.Session isn't thread-safe, so it isn't shared"""
+    if 'http_session' not in st.session_state:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        st.session_state.http_session = session
+    return st.session_state.http_session
+
 def init_session_state():
     """Initialize session state variables"""
     if 'messages' not in st.session_state:
@@ -37,25 +47,32 @@ def init_session_state():
     if 'api_key_set' not in st.session_state:
         st.session_state.api_key_set = False
 
-def fetch_documents():
+@st.cache_data(show_spinner=False)
+def list_documents():
+    """Document list from the API, cached until an upload or delete clears it"""
+    response = get_http_session().get(f"{API_BASE_URL}/listDocs")
+    response.raise_for_status()
+    return response.json()
+
+def fetch_documents(refresh=False):
     """Fetch all documents from the API"""
+    if refresh:
+        list_documents.clear()
     try:
-        response = requests.get(f"{API_BASE_URL}/listDocs")
-        if response.ok:
-            st.session_state.documents = response.json()
+        st.session_state.documents = list_documents()
     except Exception as e:
         st.error(f"Failed to fetch documents: {str(e)}")
 
 def delete_document(file_id):
     """Delete a document using the API"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_BASE_URL}/deleteDoc",
             json={"fileId": file_id}
         )
         if response.ok:
             st.success("Document deleted successfully")
-            fetch_documents()
+            fetch_documents(refresh=True)
         else:
             st.error("Failed to delete document")
     except Exception as e:
@@ -70,25 +87,90 @@ def upload_document(files):
     if not isinstance(files, list):
         files = [files]
     
+    valid_files = []
     for file in files:
         # Check file extension
         file_extension = os.path.splitext(file.name)[1].lower()
         if file_extension not in ALLOWED_EXTENSIONS:
             st.error(f"Unsupported file type for {file.name}. Allowed types are: {', '.join(ALLOWED_EXTENSIONS)}")
             continue
+        valid_files.append(file)
 
+    if len(valid_files) == 1:
+        # A single file goes through the background job queue so progress can be tracked
+        file = valid_files[0]
         try:
             files_data = {"file": (file.name, file, "application/octet-stream")}
-            response = requests.post(f"{API_BASE_URL}/uploadDoc", files=files_data)
+            response = get_http_session().post(f"{API_BASE_URL}/uploadDoc", files=files_data)
             
             if response.ok:
-                st.success(f"File {file.name} uploaded successfully")
+                if response.json().get("duplicate"):
+                    st.info(f"File {file.name} is already indexed")
+                else:
+                    wait_for_jobs({response.json()["jobId"]: file.name})
             else:
                 st.error(f"Failed to upload {file.name}")
         except Exception as e:
             st.error(f"Error uploading {file.name}: {str(e)}")
+
+    elif valid_files:
+        # Several files are sent in one request and indexed in bulk
+        try:
+            files_data = [("files", (file.name, file, "application/octet-stream")) for file in valid_files]
+            with st.spinner(f"Indexing {len(valid_files)} documents..."):
+                response = get_http_session().post(f"{API_BASE_URL}/uploadDocs", files=files_data)
+
+            if response.ok:
+                for result in response.json()["results"]:
+                    if result.get("duplicate") and result["success"]:
+                        st.info(f"File {result['filename']} is already indexed")
+                    elif result["success"]:
+                        st.success(f"File {result['filename']} uploaded successfully")
+                    else:
+                        st.error(f"Failed to upload {result['filename']}: {result['error']}")
+            else:
+                st.error("Failed to upload documents")
+        except Exception as e:
+            st.error(f"Error uploading documents: {str(e)}")
     
-    fetch_documents()
+    fetch_documents(refresh=True)
+
+def wait_for_jobs(jobs, poll_interval=1.0):
+    """Poll the ingestion jobs until every upload is stored or has failed"""
+    pending = dict(jobs)
+    with st.spinner("Indexing documents..."):
+        while pending:
+            for job_id, filename in list(pending.items()):
+                try:
+                    response = get_http_session().get(f"{API_BASE_URL}/jobs/{job_id}")
+                    job = response.json() if response.ok else {"status": "failed", "error": response.text}
+                except Exception as e:
+                    job = {"status": "failed", "error": str(e)}
+
+                if job["status"] == "stored":
+                    st.success(f"File {filename} uploaded successfully")
+                    del pending[job_id]
+                elif job["status"] == "failed":
+                    st.error(f"Failed to index {filename}: {job.get('error')}")
+                    del pending[job_id]
+            if pending:
+                time.sleep(poll_interval)
+
+def iter_sse_events(response):
+    """Parse a Server-Sent Events stream into (event, data) pairs"""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            # A blank line terminates the current event
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].lstrip())
 
 def send_message(message, model):
     """Send a message to the chat API and stream the response"""
@@ -106,7 +188,7 @@ def send_message(message, model):
                     st.write("Searching through documents...")
                     
                     # Make streaming request with existing session ID
-                    with requests.post(
+                    with get_http_session().post(
                         f"{API_BASE_URL}/chat",
                         json={
                             "question": message,
@@ -120,19 +202,33 @@ def send_message(message, model):
                             # Clear the thinking status
                             status.update(label="Found relevant information!", state="complete", expanded=False)
                             
-                            # Stream the response
+                            # Stream the response, batching tokens between re-renders
                             full_response = ""
-                            for chunk in response.iter_content(decode_unicode=True):
-                                if chunk:
-                                    full_response += chunk
+                            pending_chars = 0
+                            last_render = time.monotonic()
+                            for event, data in iter_sse_events(response):
+                                if event == "error":
+                                    st.error(f"Assistant error: {data}")
+                                    break
+                                if event == "done":
+                                    break
+                                full_response += data
+                                pending_chars += len(data)
+                                now = time.monotonic()
+                                if pending_chars >= RENDER_MIN_CHARS or now - last_render >= RENDER_INTERVAL:
                                     message_placeholder.markdown(full_response + "▌")
+                                    pending_chars = 0
+                                    last_render = now
                             
                             # Show final response without cursor
                             message_placeholder.markdown(full_response)
                             return full_response
                         else:
                             status.update(label="Error occurred", state="error")
-                            st.error("Failed to get response from the assistant")
+                            if response.status_code in (429, 503):
+                                st.error("The assistant is busy right now, please try again in a moment")
+                            else:
+                                st.error("Failed to get response from the assistant")
                             return None
                 
     except Exception as e:
@@ -142,10 +238,10 @@ def send_message(message, model):
 def clear_all_documents():
     """Clear all documents from the system"""
     try:
-        response = requests.post(f"{API_BASE_URL}/clearAllDocs")
+        response = get_http_session().post(f"{API_BASE_URL}/clearAllDocs")
         if response.ok:
             st.success("All documents cleared successfully")
-            fetch_documents()  # Refresh the document list
+            fetch_documents(refresh=True)  # Refresh the document list
         else:
             st.error("Failed to clear documents")
     except Exception as e:
@@ -154,7 +250,7 @@ def clear_all_documents():
 def set_api_key(api_key):
     """Set the OpenAI API key"""
     try:
-        response = requests.post(f"{API_BASE_URL}/setApiKey", params={"api_key": api_key})
+        response = get_http_session().post(f"{API_BASE_URL}/setApiKey", params={"api_key": api_key})
         if response.ok:
             st.session_state.api_key_set = True
             return True
@@ -217,9 +313,10 @@ def main():
         
         with col2:    
             if st.button("🔄 Refresh List", key="refresh_docs"):
-                fetch_documents()
+                fetch_documents(refresh=True)
         
-        # Display documents
+        # Display documents; served from the cache unless the list changed
+        fetch_documents()
         for doc in st.session_state.documents:
             col1, col2 = st.columns([3, 1])
             with col1:
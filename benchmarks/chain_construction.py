@@ -0,0 +1,51 @@
+"""
+Measures the per-request cost of building the RAG chain versus fetching
+the prebuilt one from the registry. No network calls are made, so a
+placeholder API key is enough. Connection reuse (no new TCP/TLS handshake
+per request) is an additional saving that this script does not capture.
+
+    python -m benchmarks.chain_construction --iterations 200
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark-placeholder')
+
+from RAG.langchain_utils import buildRagChain, getRagChain, resetRagChains
+
+
+def timeCalls(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "meanMs": statistics.mean(samples),
+        "p50Ms": statistics.median(samples),
+        "p95Ms": sorted(samples)[int(len(samples) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--model', default='gpt-4o-mini')
+    args = parser.parse_args()
+
+    resetRagChains()
+    getRagChain(args.model)
+
+    results = {
+        "perRequestBuild": timeCalls(lambda: buildRagChain(args.model), args.iterations),
+        "registryLookup": timeCalls(lambda: getRagChain(args.model), args.iterations),
+    }
+    results["speedup"] = results["perRequestBuild"]["meanMs"] / max(results["registryLookup"]["meanMs"], 1e-9)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""
+End-to-end benchmark of the FastAPI app with local stand-ins for the chat
+model and the embedding API (see benchmarks/stand_ins.py). The server runs
+in-process under uvicorn, in a fresh temporary working directory, so the
+SQLite database, Chroma store and indexes start empty. Measures:
+
+- ingestion throughput of /uploadDoc (pages/s, chunks/s)
+- retrieval latency (hybrid retrieval + context packing)
+- /chat time-to-first-byte and total latency under concurrent sessions
+- chat history lookup and write cost as application_logs grows
+
+Results are printed as JSON (or written to --output) so that runs can be
+compared across commits.
+
+    python -m benchmarks.end_to_end --sessions 8 --turns 3 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+WORDS = (
+    "cluster node pod scheduler retry queue worker latency throughput audit log "
+    "policy replica shard index cache token vector embedding batch request "
+    "response timeout budget session history upload parser chunk overlap "
+    "document page section summary model prompt context answer question "
+    "deploy rollback release version config secret credential network proxy"
+).split()
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "meanMs": statistics.mean(ordered),
+        "p50Ms": statistics.median(ordered),
+        "p95Ms": ordered[max(int(len(ordered) * 0.95) - 1, 0)],
+        "maxMs": ordered[-1],
+    }
+
+
+def randomSentence(rng, words=12):
+    sentence = ' '.join(rng.choice(WORDS) for _ in range(words))
+    # Identifiers exercise the lexical side of hybrid retrieval
+    return f"{sentence.capitalize()} (ticket OPS-{rng.randint(1000, 9999)})."
+
+
+# --- Test Documents -----------------------------------------------------
+
+def escapePdfText(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def makePdf(pages):
+    """
+    Minimal PDF with one text page per entry of `pages` (a list of lines)
+    """
+    pageCount = len(pages)
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+    pageIds = [4 + 2 * i for i in range(pageCount)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b' '.join(b"%d 0 R" % pageId for pageId in pageIds), pageCount),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for pageId, lines in zip(pageIds, pages):
+        text = ' T* '.join(f"({escapePdfText(line)}) Tj" for line in lines)
+        content = f"BT /F1 10 Tf 12 TL 40 760 Td {text} ET".encode('latin-1')
+        objects[pageId] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                           b"/Contents %d 0 R /Resources << /Font << /F1 3 0 R >> >> >>" % (pageId + 1))
+        objects[pageId + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for objectId in range(1, len(objects) + 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (objectId, objects[objectId])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+def makeCorpus(rng, documents, pagesPerDocument, linesPerPage=40):
+    corpus = []
+    for i in range(documents):
+        pages = [[randomSentence(rng) for _ in range(linesPerPage)] for _ in range(pagesPerDocument)]
+        corpus.append((f"benchmark_{i}.pdf", makePdf(pages)))
+    return corpus
+
+
+# --- In-Process Server --------------------------------------------------
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """
+    Runs the app under uvicorn in a background thread
+    """
+
+    def __init__(self, app):
+        import uvicorn
+        self.port = freePort()
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=self.port, log_level='warning'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Benchmark server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+# --- Benchmarks ---------------------------------------------------------
+
+def benchmarkIngestion(client, corpus, pagesPerDocument, timeout=600):
+    start = time.perf_counter()
+    jobIds = []
+    for filename, content in corpus:
+        response = client.post("/uploadDoc", files={"file": (filename, content, "application/pdf")})
+        response.raise_for_status()
+        jobIds.append(response.json()["jobId"])
+
+    pending, jobs = set(jobIds), {}
+    while pending:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"{len(pending)} ingestion jobs still running after {timeout}s")
+        for jobId in list(pending):
+            job = client.get(f"/jobs/{jobId}").json()
+            if job["status"] in ("stored", "failed"):
+                jobs[jobId] = job
+                pending.discard(jobId)
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    chunks = sum(job["totalChunks"] or 0 for job in jobs.values())
+    pages = len(corpus) * pagesPerDocument
+    return {
+        "documents": len(corpus),
+        "failed": sum(job["status"] == "failed" for job in jobs.values()),
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": elapsed,
+        "pagesPerSecond": pages / elapsed,
+        "chunksPerSecond": chunks / elapsed,
+    }
+
+
+def benchmarkRetrieval(rng, queries):
+    from RAG.context_utils import packContext
+    from RAG.langchain_utils import getRetriever
+
+    retriever = getRetriever()
+    retrieval, packing = [], []
+    for _ in range(queries):
+        query = ' '.join(rng.choice(WORDS) for _ in range(6))
+        start = time.perf_counter()
+        documents = retriever.invoke(query)
+        middle = time.perf_counter()
+        packContext(documents)
+        retrieval.append((middle - start) * 1000)
+        packing.append((time.perf_counter() - middle) * 1000)
+    return {"retrieve": percentiles(retrieval), "packContext": percentiles(packing)}
+
+
+async def chatTurn(client, sessionId, question, model):
+    start = time.perf_counter()
+    firstByte, failed = None, False
+    async with client.stream("POST", "/chat", json={"question": question, "sessionId": sessionId, "model": model}) as response:
+        async for line in response.aiter_lines():
+            if firstByte is None:
+                firstByte = time.perf_counter()
+            if line == "event: error":
+                failed = True
+    end = time.perf_counter()
+    return (firstByte or end) - start, end - start, failed or response.status_code != 200
+
+
+async def benchmarkChat(baseUrl, sessions, turns, model, seed):
+    import httpx
+
+    async def runSession(index, client):
+        rng = random.Random(seed + index)
+        sessionId = f"benchmark-{uuid.uuid4()}"
+        results = []
+        for _ in range(turns):
+            question = f"What does the {' '.join(rng.choice(WORDS) for _ in range(5))} section say?"
+            results.append(await chatTurn(client, sessionId, question, model))
+        return results
+
+    async with httpx.AsyncClient(base_url=baseUrl, timeout=300) as client:
+        start = time.perf_counter()
+        perSession = await asyncio.gather(*(runSession(i, client) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+
+    results = [result for session in perSession for result in session]
+    return {
+        "sessions": sessions,
+        "turnsPerSession": turns,
+        "errors": sum(failed for _, _, failed in results),
+        "requestsPerSecond": len(results) / elapsed,
+        "timeToFirstByte": percentiles([ttfb * 1000 for ttfb, _, _ in results]),
+        "total": percentiles([total * 1000 for _, total, _ in results]),
+    }
+
+
+def benchmarkHistory(sizes, turnsPerSession=20, iterations=50):
+    from RAG.db_utils import getChatHistory, insertApplicationLogs, logSink, pooledConnection
+
+    results, rows = [], 0
+    for size in sizes:
+        # Grow the table to `size` rows with filler sessions
+        batch = []
+        while rows < size:
+            sessionId = f"filler-{rows // turnsPerSession}"
+            batch.append((uuid.uuid4().hex, sessionId, f"question {rows}", f"answer {rows}", "gpt-4o-mini"))
+            rows += 1
+        with pooledConnection() as conn:
+            conn.executemany('''
+                INSERT INTO application_logs (turnId, sessionId, userQuery, response, model)
+                VALUES (?, ?, ?, ?, ?)''', batch)
+            conn.commit()
+
+        sessionId = f"filler-{(rows - 1) // turnsPerSession}"
+        reads, writes = [], []
+        for i in range(iterations):
+            start = time.perf_counter()
+            getChatHistory(sessionId)
+            reads.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            insertApplicationLogs(f"probe-{size}", f"question {i}", f"answer {i}", "gpt-4o-mini")
+            logSink.flush()
+            writes.append((time.perf_counter() - start) * 1000)
+        rows += iterations
+
+        results.append({"rows": size, "getChatHistory": percentiles(reads), "insertAndFlush": percentiles(writes)})
+    return results
+
+
+# --- Entry Point --------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=10, help="pages per document")
+    parser.add_argument('--queries', type=int, default=100, help="retrieval queries")
+    parser.add_argument('--sessions', type=int, default=8, help="concurrent chat sessions")
+    parser.add_argument('--turns', type=int, default=3, help="chat turns per session")
+    parser.add_argument('--history-sizes', default='1000,10000,100000',
+                        help="application_logs row counts at which history cost is measured")
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="seconds until the first token")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument('--embedding-text-latency', type=float, default=0.0005, help="extra seconds per embedded text")
+    parser.add_argument('--answer-cache', action='store_true',
+                        help="keep the semantic answer cache enabled (disabled by default so every turn reaches the model)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    # Everything the app creates on disk goes into a scratch directory
+    workDir = tempfile.mkdtemp(prefix='chatdocs-benchmark-')
+    outputPath = os.path.abspath(args.output) if args.output else None
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workDir)
+    os.makedirs('logs', exist_ok=True)
+
+    # The app reads its configuration at import time
+    os.environ['OPENAI_API_KEY'] = 'sk-benchmark-placeholder'
+    os.environ['EMBEDDING_BACKEND'] = 'benchmark'
+    if not args.answer_cache:
+        os.environ['ANSWER_CACHE_THRESHOLD'] = '2'
+
+    from benchmarks.stand_ins import FakeEmbeddings, fakeChatFactory
+    from RAG.embedding_utils import registerEmbeddingBackend
+
+    def createBenchmarkEmbeddings():
+        embeddings = FakeEmbeddings(requestLatency=args.embedding_latency, perTextLatency=args.embedding_text_latency)
+        return embeddings, embeddings.model
+
+    registerEmbeddingBackend('benchmark', createBenchmarkEmbeddings)
+
+    import httpx
+
+    import RAG.langchain_utils as langchainUtils
+    from api import app
+
+    langchainUtils.createChatModel = fakeChatFactory(args.llm_latency, args.llm_tokens_per_second)
+    langchainUtils.resetRagChains()
+
+    rng = random.Random(args.seed)
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key != 'output'},
+        "workDir": workDir,
+    }
+
+    with ServerThread(app) as server:
+        with httpx.Client(base_url=server.url, timeout=300) as client:
+            # Measure a warm server
+            while client.get("/ready").status_code != 200:
+                time.sleep(0.05)
+            corpus = makeCorpus(rng, args.documents, args.pages)
+            results["ingestion"] = benchmarkIngestion(client, corpus, args.pages)
+        results["retrieval"] = benchmarkRetrieval(rng, args.queries)
+        results["chat"] = asyncio.run(benchmarkChat(server.url, args.sessions, args.turns, args.model, args.seed))
+        results["history"] = benchmarkHistory([int(size) for size in args.history_sizes.split(',')])
+
+    output = json.dumps(results, indent=2)
+    if outputPath:
+        with open(outputPath, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
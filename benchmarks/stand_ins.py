@@ -0,0 +1,106 @@
+"""
+Local stand-ins for the OpenAI chat and embedding services, with
+configurable latency and token rate, so benchmarks exercise the whole
+pipeline without network access or an API key.
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (AsyncCallbackManagerForLLMRun,
+                                      CallbackManagerForLLMRun)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import (ChatGeneration, ChatGenerationChunk,
+                                    ChatResult)
+
+from RAG.embedding_utils import HashingEmbeddings
+
+DEFAULT_REPLY = (
+    "Based on the provided context, the documents describe how the service "
+    "schedules work across nodes, retries failed tasks and records every "
+    "change in the audit log, so the answer is yes."
+)
+
+
+# --- Chat Model ---------------------------------------------------------
+
+class FakeChatModel(BaseChatModel):
+    """
+    Streams a fixed reply word by word: the first token arrives after
+    `firstTokenLatency` seconds, the rest at `tokensPerSecond`.
+    """
+
+    reply: str = DEFAULT_REPLY
+    firstTokenLatency: float = 0.2
+    tokensPerSecond: float = 50.0
+    model_name: str = 'fake-chat'
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    def _tokens(self) -> List[str]:
+        words = self.reply.split(' ')
+        return [words[0]] + [f' {word}' for word in words[1:]]
+
+    def _delays(self):
+        yield self.firstTokenLatency
+        while True:
+            yield 1 / self.tokensPerSecond if self.tokensPerSecond > 0 else 0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens()
+        delays = self._delays()
+        time.sleep(sum(next(delays) for _ in tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for token, delay in zip(self._tokens(), self._delays()):
+            time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for token, delay in zip(self._tokens(), self._delays()):
+            await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def fakeChatFactory(firstTokenLatency: float, tokensPerSecond: float, reply: str = DEFAULT_REPLY):
+    """
+    Drop-in replacement for RAG.langchain_utils.createChatModel
+    """
+    def createChatModel(model: str = 'gpt-4o-mini', **kwargs):
+        return FakeChatModel(reply=reply, firstTokenLatency=firstTokenLatency,
+                             tokensPerSecond=tokensPerSecond, model_name=model)
+    return createChatModel
+
+
+# --- Embeddings ---------------------------------------------------------
+
+class FakeEmbeddings(HashingEmbeddings):
+    """
+    Local hashing embedder that also sleeps like a remote embedding API:
+    `requestLatency` seconds per call plus `perTextLatency` per input text.
+    """
+
+    def __init__(self, requestLatency: float = 0.05, perTextLatency: float = 0.0005, **kwargs):
+        super().__init__(**kwargs)
+        self.requestLatency = requestLatency
+        self.perTextLatency = perTextLatency
+        self.model = f'fake-{self.model}'
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if texts:
+            time.sleep(self.requestLatency + self.perTextLatency * len(texts))
+        return super().embed_documents(texts)
@@ -1,2 +1,72 @@
-# uvicorn api:app --reload --host 0.0.0.0 --port 8000
-streamlit run app.py
+#!/usr/bin/env bash
+# Starts the API once, waits until it is ready, then starts the Streamlit UI.
+# Stopping the UI (Ctrl+C) also stops the API. Arguments are passed on to
+# `streamlit run`, e.g. `bash run.sh --server.headless true`.
+#
+#   API_HOST=0.0.0.0 API_PORT=8000 API_WORKERS=1 bash run.sh
+#   API_BASE_URL=http://api.internal:8000 bash run.sh   # UI only, against a remote API
+
+API_HOST="${API_HOST:-0.0.0.0}"
+API_PORT="${API_PORT:-8000}"
+API_WORKERS="${API_WORKERS:-1}"
+READY_TIMEOUT="${READY_TIMEOUT:-120}"
+UI_PORT="${UI_PORT:-8501}"
+CHROMA_PORT="${CHROMA_PORT:-8001}"
+
+PIDS=()
+trap 'kill "${PIDS[@]}" 2>/dev/null; wait "${PIDS[@]}" 2>/dev/null' EXIT
+trap 'exit 130' INT TERM
+
+# Wait until a URL answers with a 2xx status. Exits if the given process
+# exits first; returns 1 after READY_TIMEOUT seconds.
+waitFor() {
+    local url="$1" pid="$2" name="$3"
+    echo "Waiting for ${url} ..."
+    local deadline=$(( $(date +%s) + READY_TIMEOUT ))
+    until python -c "import sys, urllib.request; urllib.request.urlopen(sys.argv[1], timeout=2)" "${url}" 2>/dev/null; do
+        if [ -n "${pid}" ] && ! kill -0 "${pid}" 2>/dev/null; then
+            echo "${name} exited before it became ready." >&2
+            exit 1
+        fi
+        if [ "$(date +%s)" -ge "${deadline}" ]; then
+            echo "${name} was not ready after ${READY_TIMEOUT}s." >&2
+            return 1
+        fi
+        sleep 1
+    done
+}
+
+if [ -z "${API_BASE_URL}" ]; then
+    export API_BASE_URL="http://localhost:${API_PORT}"
+
+    # --- Start Chroma ---------------------------------------------------
+
+    # Several workers can't share the embedded store, so unless CHROMA_HOST
+    # points at a Chroma server already, they share a local one
+    if [ "${API_WORKERS}" -gt 1 ] && [ -z "${CHROMA_HOST}" ]; then
+        export CHROMA_HOST=localhost CHROMA_PORT
+        chroma run --path "${CHROMA_PERSIST_DIR:-./chroma_db}" --host localhost --port "${CHROMA_PORT}" &
+        PIDS+=($!)
+        waitFor "http://localhost:${CHROMA_PORT}/api/v1/heartbeat" "$!" "Chroma" || exit 1
+    fi
+
+    # --- Start the API --------------------------------------------------
+
+    # No --reload: a file watcher has no place outside development
+    uvicorn api:app --host "${API_HOST}" --port "${API_PORT}" --workers "${API_WORKERS}" &
+    PIDS+=($!)
+    API_PID=$!
+fi
+
+# --- Wait for Readiness -------------------------------------------------
+
+# The API is ready without an OpenAI key (see GET /ready). If it still isn't
+# ready in time but is running, start the UI anyway: the key and documents
+# are managed there, and GET /ready says what is missing.
+if ! waitFor "${API_BASE_URL}/ready" "${API_PID}" "The API"; then
+    echo "Starting the UI anyway; see ${API_BASE_URL}/ready for the warm-up state." >&2
+fi
+
+# --- Start the UI -------------------------------------------------------
+
+streamlit run app.py --server.port "${UI_PORT}" "$@"
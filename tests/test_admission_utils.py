@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from RAG.admission_utils import AdmissionRejected, ModelAdmission, SingleFlight, admissions
+
+
+@pytest.fixture(autouse=True)
+def smallAdmission():
+    admissions.clear()
+    admissions['test-model'] = ModelAdmission('test-model', maxConcurrent=1, maxQueue=2, queueTimeout=5)
+    yield
+    admissions.clear()
+
+
+def makeProducer(started, release=None, parts=('p0', 'p1', 'p2')):
+    async def produce():
+        started.append(1)
+        if release is not None:
+            await release.wait()
+        for part in parts:
+            await asyncio.sleep(0)
+            yield part
+    return produce
+
+
+async def collect(subscription):
+    return ''.join([chunk async for chunk in subscription])
+
+
+async def joinAndCollect(flights, key, produce):
+    try:
+        return await collect(await flights.join(key, 'test-model', produce))
+    except AdmissionRejected as e:
+        return e.statusCode
+
+
+def test_identical_requests_share_one_generation():
+    async def main():
+        flights = SingleFlight()
+        started = []
+        produce = makeProducer(started)
+        return await asyncio.gather(*(joinAndCollect(flights, 'q', produce) for _ in range(5))), started
+
+    results, started = asyncio.run(main())
+    assert results == ['p0p1p2'] * 5
+    assert len(started) == 1
+
+
+def test_identical_requests_coalesce_while_the_model_is_busy():
+    async def main():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        busyStarted, started = [], []
+        # An unrelated generation holds the only slot
+        busy = asyncio.create_task(joinAndCollect(flights, 'other', makeProducer(busyStarted, release)))
+        while not busyStarted:
+            await asyncio.sleep(0)
+
+        produce = makeProducer(started)
+        waiting = [asyncio.create_task(joinAndCollect(flights, 'q', produce)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        assert admissions['test-model'].waiting == 1
+        release.set()
+        return await asyncio.gather(*waiting), started, await busy
+
+    results, started, busyResult = asyncio.run(main())
+    assert results == ['p0p1p2'] * 5
+    assert len(started) == 1
+    assert busyResult == 'p0p1p2'
+
+
+def test_rejection_reaches_every_joiner():
+    admissions['test-model'] = ModelAdmission('test-model', maxConcurrent=1, maxQueue=0, queueTimeout=5)
+
+    async def main():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        busyStarted, started = [], []
+        busy = asyncio.create_task(joinAndCollect(flights, 'other', makeProducer(busyStarted, release)))
+        while not busyStarted:
+            await asyncio.sleep(0)
+
+        results = await asyncio.gather(*(joinAndCollect(flights, 'q', makeProducer(started)) for _ in range(3)))
+        assert 'q' not in flights.flights
+        release.set()
+        await busy
+        return results, started
+
+    results, started = asyncio.run(main())
+    assert results == [429] * 3
+    assert not started
+
+
+def test_generation_is_cancelled_when_every_joiner_leaves_the_queue():
+    async def main():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        busyStarted, started = [], []
+        busy = asyncio.create_task(joinAndCollect(flights, 'other', makeProducer(busyStarted, release)))
+        while not busyStarted:
+            await asyncio.sleep(0)
+
+        waiting = [asyncio.create_task(flights.join('q', 'test-model', makeProducer(started))) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert 'q' not in flights.flights
+        assert admissions['test-model'].waiting == 0
+
+        release.set()
+        await busy
+        # The slot is free again
+        return await joinAndCollect(flights, 'q', makeProducer(started))
+
+    assert asyncio.run(main()) == 'p0p1p2'
+
+
+def test_request_right_after_the_last_joiner_left_starts_a_new_generation():
+    async def main():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        started = []
+        produce = makeProducer(started, release)
+        subscription = await flights.join('q', 'test-model', produce)
+        while not started:
+            await asyncio.sleep(0)
+
+        # Join before the cancelled generation has wound down
+        subscription.leave()
+        rejoined = await flights.join('q', 'test-model', produce)
+        release.set()
+        return await collect(rejoined), started
+
+    result, started = asyncio.run(main())
+    assert result == 'p0p1p2'
+    assert len(started) == 2
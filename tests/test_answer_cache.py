@@ -0,0 +1,64 @@
+import time
+
+from RAG.answer_cache import SemanticAnswerCache
+
+
+def vector(*values):
+    return list(values) + [0.0] * (4 - len(values))
+
+
+def test_hits_only_similar_questions_for_the_same_model_and_corpus_version():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store(vector(1, 0), 'gpt-4o-mini', 1, 'cached')
+
+    assert cache.lookup(vector(1, 0.01), 'gpt-4o-mini', 1) == 'cached'
+    assert cache.lookup(vector(0, 1), 'gpt-4o-mini', 1) is None
+    assert cache.lookup(vector(1, 0), 'gpt-4o', 1) is None
+    assert cache.lookup(vector(1, 0), 'gpt-4o-mini', 2) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_expired_entries_miss_and_their_rows_are_reused():
+    cache = SemanticAnswerCache(ttl=0.05, maxEntries=2)
+    cache.store(vector(1, 0), 'm', 1, 'old')
+    cache.store(vector(0, 1), 'm', 1, 'other')
+    time.sleep(0.06)
+    assert cache.lookup(vector(1, 0), 'm', 1) is None
+
+    cache.ttl = 60
+    cache.store(vector(0, 0, 1), 'm', 1, 'new')
+    assert cache.lookup(vector(0, 0, 1), 'm', 1) == 'new'
+    assert cache.stats()['entries'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticAnswerCache(maxEntries=2)
+    cache.store(vector(1, 0), 'm', 1, 'first')
+    cache.store(vector(0, 1), 'm', 1, 'second')
+    assert cache.lookup(vector(1, 0), 'm', 1) == 'first'
+
+    cache.store(vector(0, 0, 1), 'm', 1, 'third')
+    assert cache.lookup(vector(0, 1), 'm', 1) is None
+    assert cache.lookup(vector(1, 0), 'm', 1) == 'first'
+    assert cache.lookup(vector(0, 0, 1), 'm', 1) == 'third'
+
+
+def test_outdated_corpus_versions_make_room_first():
+    cache = SemanticAnswerCache(maxEntries=2)
+    cache.store(vector(1, 0), 'm', 1, 'outdated')
+    cache.store(vector(0, 1), 'm', 2, 'current')
+    cache.store(vector(0, 0, 1), 'm', 2, 'newest')
+    assert cache.lookup(vector(0, 1), 'm', 2) == 'current'
+    assert cache.lookup(vector(0, 0, 1), 'm', 2) == 'newest'
+
+
+def test_clear_and_embedding_size_change_drop_entries():
+    cache = SemanticAnswerCache()
+    cache.store(vector(1, 0), 'm', 1, 'cached')
+    cache.clear()
+    assert cache.lookup(vector(1, 0), 'm', 1) is None
+
+    cache.store(vector(1, 0), 'm', 1, 'cached')
+    cache.store([1.0, 0.0], 'm', 1, 'smaller')
+    assert cache.lookup(vector(1, 0), 'm', 1) is None
+    assert cache.lookup([1.0, 0.0], 'm', 1) == 'smaller'
@@ -0,0 +1,64 @@
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from RAG.context_utils import mergeAdjacentChunks, packContext
+
+
+def chunk(text, chunkIndex, startIndex=None, fileId=1):
+    metadata = {'fileId': fileId, 'chunkIndex': chunkIndex}
+    if startIndex is not None:
+        metadata['startIndex'] = startIndex
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_chunks_without_overlap_are_joined_with_a_newline():
+    merged = mergeAdjacentChunks([chunk('We shipped the items', 0, 0),
+                                  chunk('so we could close the ticket.', 1, 21)])
+    assert [doc.page_content for doc in merged] == ['We shipped the items\nso we could close the ticket.']
+    assert merged[0].metadata['chunkIndexEnd'] == 1
+
+
+def test_chunks_without_offsets_are_joined_with_a_newline():
+    merged = mergeAdjacentChunks([chunk('We shipped the items', 0), chunk('so we could close the ticket.', 1)])
+    assert merged[0].page_content == 'We shipped the items\nso we could close the ticket.'
+
+
+def test_overlapping_splits_are_stitched_back_into_the_original_text():
+    text = ' '.join(f'Sentence number {i} talks about topic {i % 7}.' for i in range(60))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60, add_start_index=True)
+    splits = splitter.create_documents([text])
+    chunks = [chunk(split.page_content, index, split.metadata['start_index']) for index, split in enumerate(splits)]
+
+    merged = mergeAdjacentChunks(list(reversed(chunks)))
+    assert len(merged) == 1
+    assert merged[0].page_content == text
+
+
+def test_only_consecutive_chunks_of_the_same_file_are_merged_and_rank_is_kept():
+    documents = [
+        chunk('file 2, chunk 5', 5, fileId=2),
+        chunk('file 1, chunk 3', 3),
+        chunk('file 1, chunk 1', 1),
+        chunk('file 1, chunk 2', 2),
+        Document(page_content='no position'),
+        chunk('file 1, chunk 2', 2),
+    ]
+    merged = [doc.page_content for doc in mergeAdjacentChunks(documents)]
+    assert merged == ['file 2, chunk 5', 'file 1, chunk 1\nfile 1, chunk 2\nfile 1, chunk 3', 'no position']
+
+
+def test_pack_context_skips_near_duplicates_and_keeps_the_budget():
+    documents = [
+        chunk('alpha beta gamma delta', 0, fileId=1),
+        chunk('alpha beta gamma delta', 0, fileId=2),
+        chunk('completely different words here', 0, fileId=3),
+        chunk('word ' * 400, 0, fileId=4),
+    ]
+    packed = [doc.page_content for doc in packContext(documents, budget=50)]
+    assert packed == ['alpha beta gamma delta', 'completely different words here']
+
+
+def test_pack_context_always_keeps_the_most_relevant_chunk():
+    packed = packContext([chunk('word ' * 400, 0)], budget=10)
+    assert len(packed) == 1
+    assert packContext([]) == []
@@ -0,0 +1,48 @@
+from RAG.loader_utils import detectEncoding, getLoader, loadAndSplitDocument
+
+
+def writeFile(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def loadText(filepath):
+    return ''.join(document.page_content for document in getLoader(filepath).lazy_load())
+
+
+def test_utf16_text_is_decoded_from_its_bom(tmp_path):
+    text = 'Grüße aus München.\nZweite Zeile.\n'
+    filepath = writeFile(tmp_path, 'utf16.txt', text.encode('utf-16'))
+    assert detectEncoding(filepath) == 'utf-16'
+    assert loadText(filepath) == text
+
+
+def test_cp1252_text_is_not_read_as_another_code_page(tmp_path):
+    text = 'The naïve café served “crème brûlée” – twice.\n'
+    filepath = writeFile(tmp_path, 'cp1252.txt', text.encode('cp1252'))
+    assert detectEncoding(filepath) == 'cp1252'
+    assert loadText(filepath) == text
+
+
+def test_other_code_pages_are_still_detected(tmp_path):
+    text = 'Привет мир, это тест. Мы проверяем, как определяется кодировка текста на русском языке.\n' * 3
+    filepath = writeFile(tmp_path, 'cp1251.txt', text.encode('cp1251'))
+    assert loadText(filepath) == text
+
+
+def test_html_keeps_visible_text_only(tmp_path):
+    html = '''<html><head><title>Report</title><style>p { color: red; }</style></head>
+<body><h1>Results</h1><p>First   paragraph,\twith  spaces.</p><script>var hidden = 1;</script><ul><li>One &amp; two</li><li>Three</li></ul></body></html>'''
+    filepath = writeFile(tmp_path, 'page.html', html.encode('utf-8'))
+    assert loadText(filepath) == 'Report\nResults\nFirst paragraph, with spaces.\nOne & two\nThree\n'
+
+
+def test_split_offsets_point_into_the_whole_text(tmp_path):
+    text = ''.join(f'Line {i} of a longer text file.\n' for i in range(200))
+    filepath = writeFile(tmp_path, 'long.txt', text.encode('utf-8'))
+    splits = loadAndSplitDocument(filepath)
+    assert len(splits) > 1
+    for split in splits:
+        start = split.metadata['startIndex']
+        assert text[start:start + len(split.page_content)] == split.page_content